@@ -0,0 +1,92 @@
+"""
+Latency of summing feature embeddings of one entity: the vec_sum SQL
+aggregate against fetching the embeddings and summing them with NumPy.
+
+Requires a database migrated with `recommender-db upgrade head`, all data
+is kept in a temporary table.
+
+    python benchmarks/embedding_aggregation.py --pg-url postgresql://...
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from recommender.utils.pg import DEFAULT_PG_URL
+
+FEATURE_COUNTS = (1, 10, 100, 1000, 10000)
+NUM_COMPONENTS = 30
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+parser.add_argument('--pg-url', default=DEFAULT_PG_URL,
+                    help='URL to use to connect to the database')
+parser.add_argument('--repeat', type=int, default=100,
+                    help='Number of queries per feature count')
+parser.add_argument('--dimension', type=int, default=NUM_COMPONENTS,
+                    help='Number of embedding components')
+
+SQL_QUERY = text(
+    "SELECT vec_sum(embedding) FROM bench_features WHERE entity_id = :id"
+)
+NUMPY_QUERY = text(
+    "SELECT embedding FROM bench_features WHERE entity_id = :id"
+)
+
+
+def sum_in_sql(conn, entity_id):
+    return conn.execute(SQL_QUERY, id=entity_id).scalar()
+
+
+def sum_in_numpy(conn, entity_id):
+    rows = conn.execute(NUMPY_QUERY, id=entity_id).fetchall()
+    embeddings = np.array([row[0] for row in rows], dtype=np.float32)
+    return np.sum(embeddings, axis=0).tolist()
+
+
+def timeit(func, conn, entity_id, repeat):
+    func(conn, entity_id)
+    start = perf_counter()
+    for _ in range(repeat):
+        func(conn, entity_id)
+    return (perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    args = parser.parse_args()
+    engine = create_engine(args.pg_url)
+
+    with engine.begin() as conn:
+        conn.execute(
+            "CREATE TEMPORARY TABLE bench_features "
+            "(entity_id integer, embedding real[])"
+        )
+        for entity_id, count in enumerate(FEATURE_COUNTS):
+            conn.execute(
+                text(
+                    "INSERT INTO bench_features "
+                    "SELECT :id, array_agg(random()::real) "
+                    "FROM generate_series(1, :count) feature, "
+                    "generate_series(1, :dimension) component "
+                    "GROUP BY feature"
+                ),
+                id=entity_id, count=count, dimension=args.dimension,
+            )
+        conn.execute(
+            "CREATE INDEX ON bench_features (entity_id); "
+            "ANALYZE bench_features"
+        )
+
+        print(f"{'features':>10} {'vec_sum, ms':>12} {'numpy, ms':>12}")
+        for entity_id, count in enumerate(FEATURE_COUNTS):
+            sql_ms = timeit(sum_in_sql, conn, entity_id, args.repeat)
+            numpy_ms = timeit(sum_in_numpy, conn, entity_id, args.repeat)
+            print(f"{count:>10} {sql_ms:>12.3f} {numpy_ms:>12.3f}")
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
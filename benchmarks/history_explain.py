@@ -0,0 +1,118 @@
+"""
+Plans and latency of the user history query, before and after the
+(user_id, id, item_id) index: the former query with outer joins and
+GROUP BY against the plain top-N query on interactions.
+
+Tables mirror users, items and interactions and are kept in temporary
+tables, filling 10M interactions takes a few minutes.
+
+    python benchmarks/history_explain.py --pg-url postgresql://...
+"""
+import argparse
+from time import perf_counter
+
+from sqlalchemy import create_engine, text
+
+from recommender.utils.pg import DEFAULT_PG_URL
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+parser.add_argument('--pg-url', default=DEFAULT_PG_URL,
+                    help='URL to use to connect to the database')
+parser.add_argument('--interactions', type=int, default=10_000_000,
+                    help='Number of interactions')
+parser.add_argument('--users', type=int, default=100_000,
+                    help='Number of users')
+parser.add_argument('--items', type=int, default=100_000,
+                    help='Number of items')
+parser.add_argument('--limit', type=int, default=10,
+                    help='Number of history entries per query')
+parser.add_argument('--repeat', type=int, default=100,
+                    help='Number of timed queries')
+
+QUERIES = {
+    "joins": text(
+        "SELECT bench_items.id FROM bench_users "
+        "LEFT OUTER JOIN bench_interactions "
+        "ON bench_users.id = bench_interactions.user_id "
+        "LEFT OUTER JOIN bench_items "
+        "ON bench_items.id = bench_interactions.item_id "
+        "WHERE bench_users.id = :user_id "
+        "GROUP BY bench_interactions.id, bench_items.id "
+        "ORDER BY bench_interactions.id DESC LIMIT :limit"
+    ),
+    "top-n": text(
+        "SELECT item_id AS id FROM bench_interactions "
+        "WHERE user_id = :user_id ORDER BY id DESC LIMIT :limit"
+    ),
+}
+
+
+def fill(conn, args):
+    conn.execute(
+        "CREATE TEMPORARY TABLE bench_users (id integer PRIMARY KEY); "
+        "CREATE TEMPORARY TABLE bench_items (id integer PRIMARY KEY); "
+        "CREATE TEMPORARY TABLE bench_interactions ("
+        "id integer, user_id integer, item_id integer, "
+        "PRIMARY KEY (id, user_id, item_id))"
+    )
+    conn.execute(
+        text(
+            "INSERT INTO bench_users SELECT generate_series(1, :users); "
+            "INSERT INTO bench_items SELECT generate_series(1, :items); "
+            "INSERT INTO bench_interactions "
+            "SELECT i, 1 + (random() * (:users - 1))::integer, "
+            "1 + (random() * (:items - 1))::integer "
+            "FROM generate_series(1, :interactions) i"
+        ),
+        users=args.users, items=args.items, interactions=args.interactions,
+    )
+    conn.execute("VACUUM ANALYZE bench_interactions")
+
+
+def explain(conn, name, user_id, args):
+    plan = conn.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS) {QUERIES[name].text}"),
+        user_id=user_id, limit=args.limit,
+    ).fetchall()
+    print(f"--- {name}")
+    print("\n".join(row[0] for row in plan))
+
+
+def timeit(conn, name, args):
+    start = perf_counter()
+    for i in range(args.repeat):
+        conn.execute(QUERIES[name], user_id=1 + i * 7919 % args.users,
+                     limit=args.limit).fetchall()
+    return (perf_counter() - start) * 1000 / args.repeat
+
+
+def report(conn, title, args):
+    print(f"=== {title}")
+    for name in QUERIES:
+        explain(conn, name, 1, args)
+    for name in QUERIES:
+        print(f"{name}: {timeit(conn, name, args):.3f} ms/query")
+
+
+def main():
+    args = parser.parse_args()
+    engine = create_engine(args.pg_url, isolation_level="AUTOCOMMIT")
+
+    # Temporary tables live as long as the connection
+    with engine.connect() as conn:
+        fill(conn, args)
+        report(conn, "without index", args)
+
+        conn.execute(
+            "CREATE INDEX ON bench_interactions (user_id, id, item_id)"
+        )
+        conn.execute("VACUUM ANALYZE bench_interactions")
+        report(conn, "with (user_id, id, item_id) index", args)
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
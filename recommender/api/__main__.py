@@ -2,7 +2,10 @@ import argparse
 import logging
 import os
 import pwd
+from functools import partial
+from pathlib import Path
 from sys import argv
+from typing import Callable, Optional
 
 from aiohttp.web import run_app
 from aiomisc import bind_socket
@@ -12,9 +15,14 @@ from setproctitle import setproctitle
 from yarl import URL
 
 from recommender.api.app import create_app
+from recommender.api.prefork import Supervisor
 from recommender.utils.argparse import clear_environ, positive_int
-from recommender.utils.pg import DEFAULT_PG_URL
-from recommender.utils.redis import DEFAULT_REDIS_URL
+from recommender.model.index import DEFAULT_N_PROBE
+from recommender.utils.model import DEFAULT_MODEL_DIR
+from recommender.utils.pg import DEFAULT_PG_URL, SelectQuery
+from recommender.utils.redis import (
+    DEFAULT_GENERATION_INTERVAL, DEFAULT_REDIS_TIMEOUT, DEFAULT_REDIS_URL
+)
 
 
 ENV_VAR_PREFIX = 'RECOMMENDER_'
@@ -32,6 +40,11 @@ group.add_argument('--api-address', default='0.0.0.0',
                    help='IPv4/IPv6 address API server would listen on')
 group.add_argument('--api-port', type=positive_int, default=8081,
                    help='TCP port API server would listen on')
+group.add_argument('--api-workers', type=positive_int, default=1,
+                   help='Number of worker processes, more than one starts a '
+                        'master process that restarts workers on SIGUSR2')
+group.add_argument('--api-worker-timeout', type=float, default=60,
+                   help='Time a restarted worker has to start, seconds')
 
 group = parser.add_argument_group('PostgreSQL options')
 group.add_argument('--pg-url', type=URL, default=URL(DEFAULT_PG_URL),
@@ -40,10 +53,57 @@ group.add_argument('--pg-pool-min-size', type=int, default=10,
                    help='Minimum database connections')
 group.add_argument('--pg-pool-max-size', type=int, default=10,
                    help='Maximum database connections')
+group.add_argument('--pg-cursor-prefetch', type=positive_int,
+                   default=SelectQuery.PREFETCH,
+                   help='Number of rows fetched at once by streamed responses')
+group.add_argument('--pg-stream-limit', type=positive_int, default=2,
+                   help='Maximum number of concurrent streamed responses, '
+                        'each holds a database connection until it is sent')
+group.add_argument('--pg-stream-timeout', type=float, default=60,
+                   help='Time a streamed response has to be sent, seconds')
+
+group = parser.add_argument_group('Interactions options')
+group.add_argument('--interactions-buffer-size', type=int, default=0,
+                   help='Number of single interactions buffered before they '
+                        'are saved with one query, 0 saves them immediately')
+group.add_argument('--interactions-flush-interval', type=float, default=1.0,
+                   help='Maximum time interactions are buffered, seconds')
 
 group = parser.add_argument_group('Redis options')
 group.add_argument('--redis-url', type=URL, default=URL(DEFAULT_REDIS_URL),
                    help='URL to use to connect to the cache')
+group.add_argument('--redis-pool-min-size', type=positive_int, default=10,
+                   help='Minimum cache connections')
+group.add_argument('--redis-pool-max-size', type=positive_int, default=10,
+                   help='Maximum cache connections')
+group.add_argument('--redis-timeout', type=float,
+                   default=DEFAULT_REDIS_TIMEOUT,
+                   help='Timeout of connecting and of cache commands, seconds')
+group.add_argument('--redis-generation-interval', type=float,
+                   default=DEFAULT_GENERATION_INTERVAL,
+                   help='Interval of checking for a new generation of cached '
+                        'recommendations, seconds')
+
+group = parser.add_argument_group('Entity cache options')
+group.add_argument('--entity-cache-size', type=int, default=10000,
+                   help='Maximum number of users and items cached in '
+                        'process, 0 disables the in-process tier')
+group.add_argument('--entity-cache-ttl', type=positive_int, default=300,
+                   help='TTL of users and items cached in Redis, seconds')
+group.add_argument('--entity-cache-local-ttl', type=float, default=5,
+                   help='TTL of users and items cached in process, seconds')
+
+group = parser.add_argument_group('Model options')
+group.add_argument('--model-dir', type=Path, default=Path(DEFAULT_MODEL_DIR),
+                   help='Directory with the trained model, recommendations '
+                        'are served from cache when it is missing')
+group.add_argument('--ann-probes', type=positive_int, default=DEFAULT_N_PROBE,
+                   help='Number of index lists to scan per request, when the '
+                        'model has an item index')
+group.add_argument('--model-check-interval', type=float, default=10,
+                   help='Interval of checking the registry for a new model '
+                        'version, seconds, 0 reloads only on SIGHUP or '
+                        'POST /model:reload')
 
 group = parser.add_argument_group('Logging options')
 group.add_argument('--log-level', default='info',
@@ -52,11 +112,24 @@ group.add_argument('--log-format', choices=LogFormat.choices(),
                    default='color')
 
 
+def serve(args, sock, ready: Optional[Callable[[], None]] = None):
+    # Every worker creates its own connection pools on startup
+    app = create_app(args)
+    if ready is not None:
+        async def on_startup(_):
+            ready()
+        app.on_startup.append(on_startup)
+    run_app(app, sock=sock)
+
+
 def main():
     args = parser.parse_args()
     clear_environ(lambda i: i.startswith(ENV_VAR_PREFIX))
 
-    basic_config(args.log_level, args.log_format, buffered=True)
+    # Buffered logging flushes from a thread, which forked workers would
+    # not inherit
+    basic_config(args.log_level, args.log_format,
+                 buffered=args.api_workers == 1)
 
     sock = bind_socket(address=args.api_address, port=args.api_port,
                        proto_name='http')
@@ -67,8 +140,14 @@ def main():
         os.setuid(args.user.pw_uid)
     setproctitle(os.path.basename(argv[0]))
 
-    app = create_app(args)
-    run_app(app, sock=sock)
+    if args.api_workers == 1:
+        serve(args, sock)
+        return
+
+    supervisor = Supervisor(partial(serve, args, sock),
+                            workers=args.api_workers,
+                            ready_timeout=args.api_worker_timeout)
+    supervisor.run()
 
 
 if __name__ == '__main__':
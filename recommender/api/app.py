@@ -8,11 +8,14 @@ from aiohttp.web_app import Application
 from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
 from configargparse import Namespace
 
+from recommender.api.buffer import setup_interactions_buffer
 from recommender.api.handlers import HANDLERS
 from recommender.api.middleware import error_middleware, handle_validation_error
 from recommender.api.payloads import JsonPayload
+from recommender.utils.cache import setup_entity_cache
+from recommender.utils.model import setup_model
 from recommender.utils.pg import setup_pg
-from recommender.utils.redis import setup_redis
+from recommender.utils.redis import setup_generation_watcher, setup_redis
 
 log = logging.getLogger(__name__)
 
@@ -20,7 +23,11 @@ log = logging.getLogger(__name__)
 def create_app(args: Namespace) -> Application:
     app = Application(middlewares=[error_middleware, validation_middleware])
     app.cleanup_ctx.append(partial(setup_pg, args=args))
+    app.cleanup_ctx.append(partial(setup_interactions_buffer, args=args))
     app.cleanup_ctx.append(partial(setup_redis, args=args))
+    app.cleanup_ctx.append(partial(setup_generation_watcher, args=args))
+    app.cleanup_ctx.append(partial(setup_entity_cache, args=args))
+    app.cleanup_ctx.append(partial(setup_model, args=args))
 
     for handler in HANDLERS:
         log.debug('Registering handler %r as %r', handler, handler.URL_PATH)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+from configargparse import Namespace
+
+from recommender.api.handlers.interactions import save_interactions
+
+log = logging.getLogger(__name__)
+
+
+class InteractionBuffer:
+    """
+    Write-behind buffer of single interactions, flushed with one multi-row
+    insert when it is full or every ``interval`` seconds.
+    """
+
+    def __init__(self, pg: PG, size: int, interval: float):
+        self.pg = pg
+        self.size = size
+        self.interval = interval
+        self.user_ids = []
+        self.item_ids = []
+        self.flushes: Set[asyncio.Future] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def add(self, user_id: int, item_id: int):
+        self.user_ids.append(user_id)
+        self.item_ids.append(item_id)
+        if len(self) >= self.size:
+            flush = asyncio.ensure_future(self.flush())
+            self.flushes.add(flush)
+            flush.add_done_callback(self.flushes.discard)
+
+    async def flush(self):
+        if not self:
+            return
+
+        user_ids, item_ids = self.user_ids, self.item_ids
+        self.user_ids, self.item_ids = [], []
+        try:
+            inserted = await save_interactions(self.pg, user_ids, item_ids)
+        except Exception:
+            log.exception("Failed to save %d interactions", len(user_ids))
+            return
+
+        rejected = len(user_ids) - len(inserted)
+        if rejected:
+            log.warning("Rejected %d interactions of missing users or items",
+                        rejected)
+        log.debug("Saved %d interactions", len(inserted))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await asyncio.gather(*self.flushes, return_exceptions=True)
+        await self.flush()
+
+
+async def setup_interactions_buffer(app: Application,
+                                    args: Namespace) -> InteractionBuffer:
+    app["interactions_buffer"] = None
+    if args.interactions_buffer_size <= 0:
+        yield
+        return
+
+    buffer = InteractionBuffer(app["pg"], args.interactions_buffer_size,
+                               args.interactions_flush_interval)
+    log.info("Buffering up to %d interactions for %.1f seconds",
+             buffer.size, buffer.interval)
+    buffer.start()
+    app["interactions_buffer"] = buffer
+
+    try:
+        yield
+    finally:
+        log.info("Flushing %d buffered interactions", len(buffer))
+        await buffer.stop()
@@ -1,10 +1,15 @@
+from .cache_stats import CacheStatsView
 from .item import ItemView
-from .interactions import InteractionView
+from .interactions import InteractionView, InteractionsView
+from .model import ModelReloadView
 from .user import UserView
 from .user_history import UserHistoryView
-from .user_recommendations import UserRecommendationsView
+from .user_recommendations import (
+    RecommendationsBatchView, UserRecommendationsView
+)
 
 HANDLERS = (
     ItemView, UserView, UserHistoryView,
-    UserRecommendationsView, InteractionView,
+    UserRecommendationsView, RecommendationsBatchView,
+    InteractionView, InteractionsView, CacheStatsView, ModelReloadView,
 )
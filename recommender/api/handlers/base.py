@@ -1,10 +1,35 @@
-from aiohttp.web_exceptions import HTTPNotFound
+from typing import Any, Awaitable, Callable, Collection, List, Optional
+
+from aiohttp import hdrs
+from aiohttp.web_exceptions import HTTPNotAcceptable, HTTPNotFound, HTTPOk
 from aiohttp.web_urldispatcher import View
 from aioredis import Redis
 from asyncpgsa import PG
 from sqlalchemy import select, exists
 
+from recommender.api.payloads import ENTITY_ENCODERS, JSON_CONTENT_TYPE
 from recommender.db.schema import items_table, users_table
+from recommender.model.scoring import Scorer
+from recommender.utils.cache import EntityCache
+from recommender.utils.redis import Pipeline, execute
+
+
+def parse_accept(header: str) -> List[str]:
+    """Media ranges of the Accept header, most preferred first"""
+    ranges = []
+    for position, media_range in enumerate(header.split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            ranges.append((-quality, position, media_type.lower()))
+    return [media_type for _, _, media_type in sorted(ranges)]
 
 
 class BaseView(View):
@@ -18,12 +43,80 @@ class BaseView(View):
     def redis(self) -> Redis:
         return self.request.app["redis"]
 
+    @property
+    def redis_timeout(self) -> float:
+        return self.request.app["redis_timeout"]
+
+    @property
+    def cache_generation(self) -> Optional[int]:
+        return self.request.app["generation_watcher"].generation
+
+    def redis_pipeline(self) -> Pipeline:
+        return Pipeline(self.redis, self.redis_timeout)
+
+    async def redis_execute(self, command: Awaitable) -> Any:
+        return await execute(command, self.redis_timeout)
+
+    @property
+    def model(self) -> Optional[Scorer]:
+        return self.request.app["model_reloader"].scorer
+
+    @property
+    def entity_cache(self) -> EntityCache:
+        return self.request.app["entity_cache"]
+
+    def negotiate(self, available: Collection[str],
+                  default: str = JSON_CONTENT_TYPE) -> str:
+        """Content type to respond with, according to the Accept header"""
+        accept = self.request.headers.get(hdrs.ACCEPT)
+        if not accept:
+            return default
+
+        for media_type in parse_accept(accept):
+            if media_type in ("*/*", "application/*"):
+                return default
+            if media_type in available:
+                return media_type
+        raise HTTPNotAcceptable()
+
+    @staticmethod
+    def entity_cache_key(key: str, content_type: str) -> str:
+        if content_type == JSON_CONTENT_TYPE:
+            return key
+        return f"{key}:{content_type}"
+
+    async def invalidate_entity(self, key: str):
+        """Drop the cached entity in every format"""
+        await self.entity_cache.invalidate(*(
+            self.entity_cache_key(key, content_type)
+            for content_type in ENTITY_ENCODERS
+        ))
+
+    async def read_through(self, key: str,
+                           load: Callable[[], Awaitable]) -> HTTPOk:
+        """
+        Respond with the cached entity in the negotiated format, loading and
+        caching it on miss. Every format is cached under its own key.
+        """
+        content_type = self.negotiate(ENTITY_ENCODERS)
+        cache_key = self.entity_cache_key(key, content_type)
+        body = await self.entity_cache.get(cache_key)
+        if body is None:
+            body = ENTITY_ENCODERS[content_type](await load())
+            await self.entity_cache.set(cache_key, body)
+        return HTTPOk(body=body, content_type=content_type,
+                      headers={hdrs.VARY: hdrs.ACCEPT})
+
 
 class BaseItemView(BaseView):
     @property
     def item_id(self):
         return int(self.request.match_info.get("item_id"))
 
+    @property
+    def item_cache_key(self):
+        return f"item:{self.item_id}"
+
     async def check_item_exists(self):
         query = select([
             exists().where(items_table.c.id == self.item_id)
@@ -37,6 +130,10 @@ class BaseUserView(BaseView):
     def user_id(self):
         return int(self.request.match_info.get("user_id"))
 
+    @property
+    def user_cache_key(self):
+        return f"user:{self.user_id}"
+
     async def check_user_exists(self):
         query = select([
             exists().where(users_table.c.id == self.user_id)
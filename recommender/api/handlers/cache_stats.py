@@ -0,0 +1,10 @@
+from aiohttp.web_exceptions import HTTPOk
+
+from .base import BaseView
+
+
+class CacheStatsView(BaseView):
+    URL_PATH = r"/cache/stats"
+
+    async def get(self):
+        return HTTPOk(body={"data": {"entities": self.entity_cache.stats()}})
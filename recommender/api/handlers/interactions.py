@@ -1,23 +1,93 @@
-from aiohttp.web_exceptions import HTTPAccepted
-from recommender.db.schema import interactions_table
+import json
+from typing import List, Sequence
 
-from .base import BaseUserView, BaseItemView
+from aiohttp.web_exceptions import (
+    HTTPAccepted, HTTPBadRequest, HTTPNotFound, HTTPOk
+)
+from asyncpg import ForeignKeyViolationError
+
+from recommender.api.middleware import format_http_error
+from recommender.api.schema import InteractionSchema
+
+from .base import BaseUserView, BaseItemView, BaseView
+
+MAX_INTERACTIONS = 10000
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# Rows referencing missing users or items are skipped, positions (1-based)
+# of the inserted rows are returned
+SAVE_INTERACTIONS_QUERY = """
+    WITH rows AS (
+        SELECT user_id, item_id, n
+        FROM unnest($1::integer[], $2::integer[])
+             WITH ORDINALITY AS t(user_id, item_id, n)
+    ), valid AS (
+        SELECT rows.*
+        FROM rows
+        WHERE EXISTS (SELECT 1 FROM users WHERE users.id = rows.user_id)
+          AND EXISTS (SELECT 1 FROM items WHERE items.id = rows.item_id)
+    ), inserted AS (
+        INSERT INTO interactions (user_id, item_id)
+        SELECT user_id, item_id FROM valid ORDER BY n
+    )
+    SELECT n FROM valid ORDER BY n
+"""
+
+
+async def save_interactions(pg, user_ids: Sequence[int],
+                            item_ids: Sequence[int]) -> List[int]:
+    """Insert interactions, return positions of the inserted ones"""
+    try:
+        rows = await pg.fetch(SAVE_INTERACTIONS_QUERY, user_ids, item_ids)
+    except ForeignKeyViolationError:
+        # User or item was deleted concurrently, check rows once again
+        rows = await pg.fetch(SAVE_INTERACTIONS_QUERY, user_ids, item_ids)
+    return [row["n"] - 1 for row in rows]
 
 
 class InteractionView(BaseUserView, BaseItemView):
     URL_PATH = r"/users/{user_id:\d+}/interact/{item_id:\d+}"
 
-    @staticmethod
-    async def save_interaction(conn, user_id, item_id):
-        value = {"user_id": user_id, "item_id": item_id}
-        query = interactions_table.insert().values(value)
-        await conn.execute(query)
-
     async def post(self):
-        await self.check_user_exists()
-        await self.check_item_exists()
-
-        async with self.pg.transaction() as conn:
-            await self.save_interaction(conn, self.user_id, self.item_id)
+        buffer = self.request.app["interactions_buffer"]
+        if buffer is not None:
+            buffer.add(self.user_id, self.item_id)
+            return HTTPAccepted()
 
+        if not await save_interactions(self.pg, [self.user_id],
+                                       [self.item_id]):
+            raise HTTPNotFound()
         return HTTPAccepted()
+
+
+class InteractionsView(BaseView):
+    URL_PATH = r"/interactions"
+
+    async def read_interactions(self):
+        try:
+            if self.request.content_type == NDJSON_CONTENT_TYPE:
+                lines = (await self.request.text()).splitlines()
+                data = [json.loads(line) for line in lines if line.strip()]
+            else:
+                data = await self.request.json()
+        except ValueError:
+            raise format_http_error(HTTPBadRequest, "Malformed JSON")
+
+        if isinstance(data, list) and len(data) > MAX_INTERACTIONS:
+            raise format_http_error(
+                HTTPBadRequest,
+                f"At most {MAX_INTERACTIONS} interactions are allowed"
+            )
+        return InteractionSchema(many=True).load(data)
+
+    async def post(self):
+        interactions = await self.read_interactions()
+        user_ids = [i["user_id"] for i in interactions]
+        item_ids = [i["item_id"] for i in interactions]
+
+        inserted = set(await save_interactions(self.pg, user_ids, item_ids))
+        rejected = [i for i in range(len(interactions)) if i not in inserted]
+        return HTTPOk(body={"data": {
+            "inserted": len(inserted),
+            "rejected": rejected,
+        }})
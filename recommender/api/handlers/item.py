@@ -1,63 +1,73 @@
-from aiohttp.web_exceptions import HTTPOk, HTTPAccepted, HTTPNoContent
+import numpy as np
+from aiohttp.web_exceptions import HTTPAccepted, HTTPNoContent, HTTPNotFound
 from aiohttp_apispec import request_schema
-from sqlalchemy import func, select
+from sqlalchemy import bindparam, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 
 from recommender.api.schema import ItemSchema
 from recommender.db.schema import (
     items_table, item_features_table, item_description_table
 )
+from recommender.utils.pg import compile_statement, decode_real_array
 
 from .base import BaseItemView
 
 
+# Features are aggregated as {id, description} objects, their embeddings
+# separately in the same order, in the binary array_send() format
+GET_ITEM_QUERY = compile_statement(
+    select([
+        items_table.c.id,
+        func.json_agg(
+            aggregate_order_by(
+                func.json_build_object(
+                    literal_column("'id'"), item_features_table.c.id,
+                    literal_column("'description'"),
+                    item_features_table.c.description,
+                ),
+                item_features_table.c.id
+            )
+        ).filter(
+            item_features_table.c.id.isnot(None)
+        ).label("features"),
+        func.array_agg(
+            aggregate_order_by(
+                func.array_send(item_features_table.c.embedding),
+                item_features_table.c.id
+            )
+        ).filter(
+            item_features_table.c.id.isnot(None)
+        ).label("embeddings"),
+    ]).select_from(
+        items_table.outerjoin(
+            item_description_table,
+            items_table.c.id == item_description_table.c.item_id
+        ).outerjoin(
+            item_features_table,
+            item_features_table.c.id == item_description_table.c.feature_id
+        )
+    ).where(
+        items_table.c.id == bindparam("item_id")
+    ).group_by(
+        items_table.c.id
+    )
+)
+
+
 class ItemView(BaseItemView):
     URL_PATH = r"/items/{item_id:\d+}"
 
     @staticmethod
     async def get_item(conn, item_id):
-        query = select([
-            items_table.c.id,
-            func.vec_sum(
-                item_features_table.c.embedding
-            ).label("embedding"),
-            func.array_remove(
-                func.array_agg(item_features_table.c.id),
-                None
-            ).label("feature_ids")
-        ]).select_from(
-            items_table.outerjoin(
-                item_description_table,
-                items_table.c.id == item_description_table.c.item_id
-            ).outerjoin(
-                item_features_table,
-                item_features_table.c.id == item_description_table.c.feature_id
-            )
-        ).where(
-            items_table.c.id == item_id
-        ).group_by(
-            items_table.c.id
-        )
-        return await conn.fetchrow(query)
+        return await conn.fetchrow(GET_ITEM_QUERY, item_id)
 
     @staticmethod
-    async def get_features(conn, feature_ids):
-        if not feature_ids:
-            return []
-        query = select([
-            item_features_table.c.id,
-            item_features_table.c.description,
-            item_features_table.c.embedding,
-        ]).where(
-            item_features_table.c.id.in_(feature_ids)
-        )
-        return await conn.fetch(query)
-
-    # @staticmethod
-    # def compute_embedding(features):
-    #     if not features:
-    #         return None
-    #     embeddings = [f["embedding"] for f in features]
-    #     return np.sum(np.array(embeddings), axis=0).tolist()
+    def compute_embedding(features):
+        embeddings = [f["embedding"] for f in features
+                      if f["embedding"] is not None]
+        if not embeddings:
+            return None
+        return np.sum(np.array(embeddings, dtype=np.float32), axis=0)
 
     @staticmethod
     async def create_item(conn, item_id, data):
@@ -82,15 +92,22 @@ class ItemView(BaseItemView):
         )
         await conn.execute(query)
 
+    async def load_item(self):
+        item = await self.get_item(self.pg, self.item_id)
+        if item is None:
+            raise HTTPNotFound()
+
+        features = item["features"] or []
+        for feature, embedding in zip(features, item["embeddings"] or []):
+            feature["embedding"] = decode_real_array(embedding)
+        return {
+            "id": item["id"],
+            "embedding": self.compute_embedding(features),
+            "features": features,
+        }
+
     async def get(self):
-        await self.check_item_exists()
-        async with self.pg.transaction() as conn:
-            item = await self.get_item(conn, self.item_id)
-            # TODO Get features via one query
-            item = dict(item)
-            feature_ids = item.pop("feature_ids", [])
-            item["features"] = await self.get_features(conn, feature_ids)
-        return HTTPOk(body={"data": item})
+        return await self.read_through(self.item_cache_key, self.load_item)
 
     @request_schema(ItemSchema)
     async def put(self):
@@ -98,10 +115,12 @@ class ItemView(BaseItemView):
             feature_ids = self.request["data"].pop("feature_ids")
             await self.create_item(conn, self.item_id, self.request["data"])
             await self.create_item_description(conn, self.item_id, feature_ids)
+        await self.invalidate_entity(self.item_cache_key)
         return HTTPAccepted()
 
     async def delete(self):
         await self.check_item_exists()
         async with self.pg.transaction() as conn:
             await self.delete_item(conn, self.item_id)
+        await self.invalidate_entity(self.item_cache_key)
         return HTTPNoContent()
@@ -0,0 +1,11 @@
+from aiohttp.web_exceptions import HTTPOk
+
+from .base import BaseView
+
+
+class ModelReloadView(BaseView):
+    URL_PATH = r"/model:reload"
+
+    async def post(self):
+        version = await self.request.app["model_reloader"].reload()
+        return HTTPOk(body={"data": {"version": version}})
@@ -1,63 +1,81 @@
-from aiohttp.web_exceptions import HTTPOk, HTTPAccepted, HTTPNoContent
+import asyncio
+import logging
+
+import numpy as np
+from aiohttp.web_exceptions import HTTPAccepted, HTTPNoContent, HTTPNotFound
 from aiohttp_apispec import request_schema
-from sqlalchemy import func, select
+from aioredis import RedisError
+from sqlalchemy import bindparam, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 
 from recommender.api.schema import UserSchema
 from recommender.db.schema import (
     users_table, user_features_table, user_description_table
 )
+from recommender.utils.pg import compile_statement, decode_real_array
+from recommender.utils.redis import (
+    USERS_BUILD_KEY, USERS_KEY, USERS_READY_KEY
+)
 
 from .base import BaseUserView
 
+log = logging.getLogger(__name__)
+
+# Features are aggregated as {id, description} objects, their embeddings
+# separately in the same order, in the binary array_send() format
+GET_USER_QUERY = compile_statement(
+    select([
+        users_table.c.id,
+        func.json_agg(
+            aggregate_order_by(
+                func.json_build_object(
+                    literal_column("'id'"), user_features_table.c.id,
+                    literal_column("'description'"),
+                    user_features_table.c.description,
+                ),
+                user_features_table.c.id
+            )
+        ).filter(
+            user_features_table.c.id.isnot(None)
+        ).label("features"),
+        func.array_agg(
+            aggregate_order_by(
+                func.array_send(user_features_table.c.embedding),
+                user_features_table.c.id
+            )
+        ).filter(
+            user_features_table.c.id.isnot(None)
+        ).label("embeddings"),
+    ]).select_from(
+        users_table.outerjoin(
+            user_description_table,
+            users_table.c.id == user_description_table.c.user_id
+        ).outerjoin(
+            user_features_table,
+            user_features_table.c.id == user_description_table.c.feature_id
+        )
+    ).where(
+        users_table.c.id == bindparam("user_id")
+    ).group_by(
+        users_table.c.id
+    )
+)
+
 
 class UserView(BaseUserView):
     URL_PATH = r"/users/{user_id:\d+}"
 
     @staticmethod
     async def get_user(conn, user_id):
-        query = select([
-            users_table.c.id,
-            func.vec_sum(
-                user_features_table.c.embedding
-            ).label("embedding"),
-            func.array_remove(
-                func.array_agg(user_features_table.c.id),
-                None
-            ).label("feature_ids")
-        ]).select_from(
-            users_table.outerjoin(
-                user_description_table,
-                users_table.c.id == user_description_table.c.user_id
-            ).outerjoin(
-                user_features_table,
-                user_features_table.c.id == user_description_table.c.feature_id
-            )
-        ).where(
-            users_table.c.id == user_id
-        ).group_by(
-            users_table.c.id
-        )
-        return await conn.fetchrow(query)
+        return await conn.fetchrow(GET_USER_QUERY, user_id)
 
     @staticmethod
-    async def get_features(conn, feature_ids):
-        if not feature_ids:
-            return []
-        query = select([
-            user_features_table.c.id,
-            user_features_table.c.description,
-            user_features_table.c.embedding,
-        ]).where(
-            user_features_table.c.id.in_(feature_ids)
-        )
-        return await conn.fetch(query)
-
-    # @staticmethod
-    # def compute_embedding(features):
-    #     if not features:
-    #         return None
-    #     embeddings = [f["embedding"] for f in features]
-    #     return np.sum(np.array(embeddings), axis=0).tolist()
+    def compute_embedding(features):
+        embeddings = [f["embedding"] for f in features
+                      if f["embedding"] is not None]
+        if not embeddings:
+            return None
+        return np.sum(np.array(embeddings, dtype=np.float32), axis=0)
 
     @staticmethod
     async def create_user(conn, user_id, data):
@@ -83,15 +101,45 @@ class UserView(BaseUserView):
         )
         await conn.execute(query)
 
+    async def update_user_ids(self, exists: bool):
+        """
+        Called after the change is committed, so a Redis failure does not fail
+        the request: the set of user ids is marked as not ready instead, and
+        lookups fall back to Postgres until the next run of the cache job.
+        """
+        pipe = self.redis_pipeline()
+        for key in (USERS_KEY, USERS_BUILD_KEY):
+            if exists:
+                pipe.sadd(key, self.user_id)
+            else:
+                pipe.srem(key, self.user_id)
+        try:
+            await pipe.execute()
+        except (RedisError, OSError, asyncio.TimeoutError):
+            log.warning("Failed to update cached id of user %d",
+                        self.user_id, exc_info=True)
+            try:
+                await self.redis_execute(self.redis.delete(USERS_READY_KEY))
+            except (RedisError, OSError, asyncio.TimeoutError):
+                log.warning("Failed to reset %r", USERS_READY_KEY,
+                            exc_info=True)
+
+    async def load_user(self):
+        user = await self.get_user(self.pg, self.user_id)
+        if user is None:
+            raise HTTPNotFound()
+
+        features = user["features"] or []
+        for feature, embedding in zip(features, user["embeddings"] or []):
+            feature["embedding"] = decode_real_array(embedding)
+        return {
+            "id": user["id"],
+            "embedding": self.compute_embedding(features),
+            "features": features,
+        }
+
     async def get(self):
-        await self.check_user_exists()
-        async with self.pg.transaction() as conn:
-            user = await self.get_user(conn, self.user_id)
-            # TODO Get features via one query
-            user = dict(user)
-            feature_ids = user.pop("feature_ids", [])
-            user["features"] = await self.get_features(conn, feature_ids)
-        return HTTPOk(body={"data": user})
+        return await self.read_through(self.user_cache_key, self.load_user)
 
     @request_schema(UserSchema)
     async def put(self):
@@ -99,10 +147,14 @@ class UserView(BaseUserView):
             feature_ids = self.request["data"].pop("feature_ids", [])
             await self.create_user(conn, self.user_id, self.request["data"])
             await self.create_user_description(conn, self.user_id, feature_ids)
+        await self.update_user_ids(exists=True)
+        await self.invalidate_entity(self.user_cache_key)
         return HTTPAccepted()
 
     async def delete(self):
         await self.check_user_exists()
         async with self.pg.transaction() as conn:
             await self.delete_user(conn, self.user_id)
+        await self.update_user_ids(exists=False)
+        await self.invalidate_entity(self.user_cache_key)
         return HTTPNoContent()
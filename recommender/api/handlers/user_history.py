@@ -1,14 +1,44 @@
-from aiohttp.web_exceptions import HTTPOk
+import asyncio
+import logging
+
+from aiohttp.web_exceptions import HTTPOk, HTTPServiceUnavailable
+from aiohttp.web_response import Response
 from aiohttp_apispec import querystring_schema
-from sqlalchemy import select, desc
+from sqlalchemy import bindparam, desc, select
+from sqlalchemy.sql import Select
 
+from recommender.api.payloads import AsyncGenJSONListPayload
 from recommender.api.schema import HistoryQSSchema
-from recommender.db.schema import (
-    users_table, interactions_table, items_table
-)
+from recommender.db.schema import interactions_table
+from recommender.utils.pg import SelectQuery, compile_statement
 
 from .base import BaseUserView
 
+log = logging.getLogger(__name__)
+
+# Top-N scan of ix__interactions__user_id_id_item_id in every partition,
+# merged by id, so a page takes a single query however old the history is
+def select_history(paged: bool = False) -> Select:
+    query = select([
+        interactions_table.c.item_id.label("id"),
+        interactions_table.c.id.label("interaction_id"),
+    ]).where(
+        interactions_table.c.user_id == bindparam("user_id")
+    )
+    if paged:
+        query = query.where(
+            interactions_table.c.id < bindparam("before")
+        )
+    return query.order_by(desc(interactions_table.c.id))
+
+
+GET_HISTORY_QUERY = compile_statement(
+    select_history().limit(bindparam("limit"))
+)
+GET_HISTORY_PAGE_QUERY = compile_statement(
+    select_history(paged=True).limit(bindparam("limit"))
+)
+
 
 class UserHistoryView(BaseUserView):
     URL_PATH = r"/users/{user_id:\d+}/history"
@@ -17,32 +47,70 @@ class UserHistoryView(BaseUserView):
     def limit(self):
         return int(self.request["querystring"].get("limit", 10))
 
+    @property
+    def before(self):
+        return self.request["querystring"].get("before")
+
+    @property
+    def stream(self):
+        return self.request["querystring"].get("stream", False)
+
     @staticmethod
-    async def get_history(conn, user_id, limit):
-        query = select([
-            items_table.c.id,
-        ]).select_from(
-            users_table.outerjoin(
-                interactions_table,
-                users_table.c.id == interactions_table.c.user_id
-            ).outerjoin(
-                items_table,
-                items_table.c.id == interactions_table.c.item_id
+    async def get_history(conn, user_id, limit, before=None):
+        if before is not None:
+            return await conn.fetch(GET_HISTORY_PAGE_QUERY,
+                                    before, limit, user_id)
+        return await conn.fetch(GET_HISTORY_QUERY, limit, user_id)
+
+    def stream_history(self) -> SelectQuery:
+        """Whole history, read with a cursor while it is being sent"""
+        params = {"user_id": self.user_id}
+        if self.before is not None:
+            params["before"] = self.before
+        query = select_history(paged=self.before is not None).params(params)
+        return SelectQuery(query, self.pg.transaction(),
+                           prefetch=self.request.app["pg_cursor_prefetch"],
+                           timeout=self.request.app["pg_stream_timeout"])
+
+    async def send_stream(self) -> Response:
+        """
+        Streams hold a database connection until the client has read them,
+        so they are rejected when --pg-stream-limit of them are running and
+        cut off after --pg-stream-timeout.
+        """
+        semaphore = self.request.app["pg_stream_semaphore"]
+        if semaphore.locked():
+            raise HTTPServiceUnavailable()
+
+        async with semaphore:
+            response = Response(
+                body=AsyncGenJSONListPayload(self.stream_history())
             )
-        ).where(
-            users_table.c.id == user_id
-        ).group_by(
-            interactions_table.c.id,
-            items_table.c.id,
-        ).order_by(
-            desc(interactions_table.c.id)
-        ).limit(limit)
-        return await conn.fetch(query)
+            try:
+                await asyncio.wait_for(
+                    self.write_response(response),
+                    self.request.app["pg_stream_timeout"]
+                )
+            except asyncio.TimeoutError:
+                # Headers are sent already, the connection is closed so the
+                # client does not take the cut off body for a complete one
+                log.warning("History stream of user %d timed out",
+                            self.user_id)
+                if self.request.transport is not None:
+                    self.request.transport.close()
+        return response
+
+    async def write_response(self, response: Response):
+        await response.prepare(self.request)
+        await response.write_eof()
 
     @querystring_schema(HistoryQSSchema)
     async def get(self):
         await self.check_user_exists()
 
-        async with self.pg.transaction() as conn:
-            history = await self.get_history(conn, self.user_id, self.limit)
+        if self.stream:
+            return await self.send_stream()
+
+        history = await self.get_history(self.pg, self.user_id, self.limit,
+                                         self.before)
         return HTTPOk(body={"data": history})
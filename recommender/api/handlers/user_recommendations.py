@@ -1,12 +1,101 @@
-from aiohttp.web_exceptions import HTTPOk
-from aiohttp_apispec import querystring_schema
+import asyncio
+from typing import Dict, List
 
-from recommender.api.schema import RecommendationQSSchema
+import numpy as np
+from aiohttp.web_exceptions import HTTPNotFound, HTTPOk
+from aiohttp.web_response import Response
+from aiohttp_apispec import querystring_schema, request_schema
+from sqlalchemy import ARRAY, Integer, any_, bindparam, select
 
-from .base import BaseUserView
+from recommender.api.payloads import AsyncGenJSONListPayload
+from recommender.api.schema import (
+    RecommendationQSSchema, RecommendationsBatchSchema
+)
+from recommender.db.schema import users_table
+from recommender.utils.pg import compile_statement
+from recommender.utils.redis import (
+    ITEM_DTYPE, USERS_KEY, USERS_READY_KEY, latest_key, recommendations_key,
+    unpack,
+)
 
+from .base import BaseUserView, BaseView
 
-class UserRecommendationsView(BaseUserView):
+GET_EXISTING_USERS_QUERY = compile_statement(
+    select([
+        users_table.c.id
+    ]).where(
+        users_table.c.id == any_(bindparam("user_ids", type_=ARRAY(Integer)))
+    )
+)
+
+
+class BaseRecommendationsView(BaseView):
+    async def get_existing_users(self, user_ids: List[int]) -> List[int]:
+        """
+        Existing users are looked up in the Redis set of user ids, Postgres
+        is only queried until the cache job has populated it. Ids added by
+        the API alone do not make the set complete.
+        """
+        pipe = self.redis_pipeline()
+        pipe.exists(USERS_READY_KEY)
+        for user_id in user_ids:
+            pipe.sismember(USERS_KEY, user_id)
+        ready, *members = await pipe.execute()
+
+        if not ready:
+            rows = await self.pg.fetch(GET_EXISTING_USERS_QUERY, user_ids)
+            members = {row["id"] for row in rows}
+            members = [i in members for i in user_ids]
+
+        return [i for i, member in zip(user_ids, members) if member]
+
+    async def get_cached_recommendations(
+            self, user_ids: List[int], limit: int) -> Dict[int, List[int]]:
+        # Random latest items for users without precomputed lists are read
+        # in the same round-trip
+        generation = self.cache_generation
+        if generation is None:
+            return {user_id: [] for user_id in user_ids}
+
+        pipe = self.redis_pipeline()
+        for user_id in user_ids:
+            pipe.getrange(recommendations_key(generation, user_id),
+                          0, limit * ITEM_DTYPE.itemsize - 1)
+        pipe.srandmember(latest_key(generation), limit)
+        *values, latest = await pipe.execute()
+
+        latest = [int(i) for i in latest]
+        return {
+            user_id: unpack(value).tolist() if value else latest
+            for user_id, value in zip(user_ids, values)
+        }
+
+    async def recommend(self, user_ids: List[int],
+                        limit: int) -> Dict[int, List[int]]:
+        """Score users known to the model, the rest are served from cache"""
+        recommendations = {}
+        # The model may be swapped while the request is served
+        model = self.model
+        if model is not None:
+            rows = model.user_rows(user_ids)
+            known = rows >= 0
+            if known.any():
+                # Scoring a batch takes long enough to stall other requests
+                loop = asyncio.get_event_loop()
+                items = await loop.run_in_executor(None, model.top_k,
+                                                   rows[known], limit)
+                known_ids = np.asarray(user_ids)[known].tolist()
+                recommendations.update(zip(known_ids, items.tolist()))
+
+        missing = [i for i in user_ids if i not in recommendations]
+        if missing:
+            recommendations.update(
+                await self.get_cached_recommendations(missing, limit)
+            )
+        return recommendations
+
+
+class UserRecommendationsView(BaseRecommendationsView, BaseUserView):
     URL_PATH = r"/users/{user_id:\d+}/recommendations"
 
     @property
@@ -15,11 +104,42 @@ class UserRecommendationsView(BaseUserView):
 
     @querystring_schema(RecommendationQSSchema)
     async def get(self):
-        await self.check_user_exists()
+        if not await self.get_existing_users([self.user_id]):
+            raise HTTPNotFound()
 
-        items = await self.redis.lrange(f"{self.user_id}", 0, self.limit)
-        if not items:
-            items = await self.redis.srandmember("latest", self.limit)
-
-        items = [{"id": int(i.decode())} for i in items]
+        items = await self.recommend([self.user_id], self.limit)
+        items = [{"id": i} for i in items[self.user_id]]
         return HTTPOk(body={"data": items})
+
+
+class RecommendationsBatchView(BaseRecommendationsView):
+    URL_PATH = r"/recommendations:batch"
+
+    @property
+    def limit(self):
+        return int(self.request["data"].get("limit", 10))
+
+    @property
+    def user_ids(self):
+        # Unique ids in the requested order
+        return list(dict.fromkeys(self.request["data"]["user_ids"]))
+
+    @staticmethod
+    async def iter_recommendations(user_ids, recommendations):
+        for user_id in user_ids:
+            yield {
+                "id": user_id,
+                "recommendations": [
+                    {"id": i} for i in recommendations[user_id]
+                ],
+            }
+
+    @request_schema(RecommendationsBatchSchema)
+    async def post(self):
+        # Unknown users are left out of the response
+        user_ids = await self.get_existing_users(self.user_ids)
+        recommendations = await self.recommend(user_ids, self.limit)
+        body = AsyncGenJSONListPayload(
+            self.iter_recommendations(user_ids, recommendations)
+        )
+        return Response(body=body)
@@ -1,12 +1,34 @@
 import json
 from decimal import Decimal
-from functools import partial, singledispatch
-from typing import Any
+from functools import singledispatch
+from typing import Any, Callable, Dict
 
-from aiohttp.payload import JsonPayload as BaseJsonPayload, Payload
-from aiohttp.typedefs import JSONEncoder
+import numpy as np
+from aiohttp.payload import BytesPayload, Payload
 from asyncpg import Record
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+FLOAT32_CONTENT_TYPE = "application/octet-stream"
+
+# Embeddings in binary formats are packed as little-endian float32
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+# Размер буфера, после которого потоковый ответ отправляется клиенту
+CHUNK_SIZE = 64 * 1024
+
+JSONBytesEncoder = Callable[[Any], bytes]
+
 
 @singledispatch
 def convert(value):
@@ -23,47 +45,123 @@ def convert_decimal(value: Decimal):
     return float(value)
 
 
-dumps = partial(json.dumps, default=convert, ensure_ascii=False)
+@convert.register(np.ndarray)
+def convert_ndarray(value: np.ndarray):
+    return value.tolist()
+
+
+@convert.register(np.generic)
+def convert_numpy_scalar(value: np.generic):
+    return value.item()
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=convert, ensure_ascii=False)
+
+
+if orjson is not None:
+    def dumpb(value: Any) -> bytes:
+        """
+        Serializes straight to UTF-8 bytes, numpy arrays are encoded
+        natively, Records and Decimals go through convert.
+        """
+        return orjson.dumps(value, default=convert,
+                            option=orjson.OPT_SERIALIZE_NUMPY)
+else:
+    def dumpb(value: Any) -> bytes:
+        return dumps(value).encode()
 
 
-class JsonPayload(BaseJsonPayload):
+def convert_msgpack(value):
+    if isinstance(value, np.ndarray) and value.dtype.kind == "f":
+        return value.astype(EMBEDDING_DTYPE, copy=False).tobytes()
+    return convert(value)
+
+
+def encode_json(entity: Any) -> bytes:
+    return dumpb({"data": entity})
+
+
+def encode_msgpack(entity: Any) -> bytes:
+    """Float arrays are packed as bin values of little-endian float32"""
+    return msgpack.packb({"data": entity}, default=convert_msgpack,
+                         use_bin_type=True)
+
+
+def encode_float32(entity: Any) -> bytes:
+    """Only the embedding of the entity, empty if there is none"""
+    embedding = entity["embedding"]
+    if embedding is None:
+        return b""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+# Formats of entities with embeddings, JSON is served by default
+ENTITY_ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    JSON_CONTENT_TYPE: encode_json,
+    FLOAT32_CONTENT_TYPE: encode_float32,
+}
+if msgpack is not None:
+    ENTITY_ENCODERS[MSGPACK_CONTENT_TYPE] = encode_msgpack
+
+
+class JsonPayload(BytesPayload):
     def __init__(self,
                  value: Any,
                  encoding: str = "utf-8",
-                 content_type: str = "application/json",
-                 dumps: JSONEncoder = dumps,
+                 content_type: str = JSON_CONTENT_TYPE,
+                 dumps: JSONBytesEncoder = dumpb,
                  *args: Any,
                  **kwargs: Any) -> None:
-        super().__init__(value, encoding, content_type, dumps, *args, **kwargs)
+        super().__init__(dumps(value), content_type=content_type,
+                         encoding=encoding, *args, **kwargs)
 
 
 class AsyncGenJSONListPayload(Payload):
     def __init__(self, value, encoding: str = "utf-8",
-                 content_type: str = "application/json",
+                 content_type: str = JSON_CONTENT_TYPE,
                  root_object: str = "data",
+                 dumps: JSONBytesEncoder = dumpb,
+                 chunk_size: int = CHUNK_SIZE,
                  *args, **kwargs):
         self.root_object = root_object
+        self.dumps = dumps
+        self.chunk_size = chunk_size
         super().__init__(value, content_type=content_type, encoding=encoding,
                          *args, **kwargs)
 
     async def write(self, writer):
         # Начало объекта
-        await writer.write(
+        buffer = bytearray(
             ('{"%s":[' % self.root_object).encode(self._encoding)
         )
 
         first = True
-        async for row in self._value:
-            # Перед первой строчкой запятая не нужнаа
-            if not first:
-                await writer.write(b",")
-            else:
-                first = False
-
-            await writer.write(dumps(row).encode(self._encoding))
+        rows = self._value.__aiter__()
+        try:
+            async for row in rows:
+                # Перед первой строчкой запятая не нужна
+                if not first:
+                    buffer += b","
+                else:
+                    first = False
+
+                buffer += self.dumps(row)
+                if len(buffer) >= self.chunk_size:
+                    await writer.write(bytes(buffer))
+                    buffer.clear()
+        finally:
+            # Генератор, прерванный во время записи, освобождает ресурсы
+            # сразу, а не при сборке мусора
+            if hasattr(rows, "aclose"):
+                await rows.aclose()
 
         # Конец объекта
-        await writer.write(b"]}")
+        buffer += b"]}"
+        await writer.write(bytes(buffer))
 
 
-__all__ = ("JsonPayload", "AsyncGenJSONListPayload")
+__all__ = (
+    "JsonPayload", "AsyncGenJSONListPayload", "dumpb",
+    "ENTITY_ENCODERS", "JSON_CONTENT_TYPE",
+)
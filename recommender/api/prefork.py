@@ -0,0 +1,184 @@
+import logging
+import os
+import select
+import signal
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Set
+
+log = logging.getLogger(__name__)
+
+SIGNALS = {
+    signal.SIGCHLD, signal.SIGHUP, signal.SIGUSR2,
+    signal.SIGINT, signal.SIGTERM,
+}
+
+# Workers exiting sooner than MIN_UPTIME after start, e.g. while the database
+# is down, are replaced after a delay doubling up to RESPAWN_MAX_DELAY
+MIN_UPTIME = 10.0
+RESPAWN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 30.0
+
+# Called in a worker process with a callback to report it is ready to serve
+Worker = Callable[[Callable[[], None]], None]
+
+
+class Supervisor:
+    """
+    Pre-fork master process: runs ``workers`` processes that accept
+    connections on a socket they inherit and replaces those that exit.
+
+    SIGHUP is forwarded to workers, which reload the model in place. SIGUSR2
+    restarts workers one by one, every replacement has to report it is ready
+    before the worker it replaces is stopped, so requests are served during
+    the restart. SIGINT and SIGTERM stop all workers. Workers that keep
+    failing right after start are replaced with a growing delay.
+    """
+
+    def __init__(self, worker: Worker, workers: int, ready_timeout: float):
+        self.worker = worker
+        self.workers = workers
+        self.ready_timeout = ready_timeout
+        self.pids: Dict[int, int] = {}
+        self.started: Dict[int, float] = {}
+        self.retiring: Set[int] = set()
+        self.respawns: List[float] = []
+        self.failures = 0
+        self.stopping = False
+
+    def spawn(self) -> int:
+        """Start a worker, it reports it is ready through a pipe"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            self.pids[pid] = read_fd
+            self.started[pid] = monotonic()
+            log.info("Started worker %d", pid)
+            return pid
+
+        # Worker process, pipes of other workers are only read by the master
+        os.close(read_fd)
+        for fd in self.pids.values():
+            os.close(fd)
+        signal.pthread_sigmask(signal.SIG_SETMASK, set())
+        for signum in SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        # Until the worker handles SIGHUP itself, it must not be killed by it
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        def ready():
+            os.write(write_fd, b"1")
+            os.close(write_fd)
+
+        status = 0
+        try:
+            self.worker(ready)
+        except BaseException:
+            log.exception("Worker %d failed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def wait_ready(self, pid: int) -> bool:
+        read_fd = self.pids[pid]
+        readable, _, _ = select.select([read_fd], [], [], self.ready_timeout)
+        return bool(readable) and os.read(read_fd, 1) == b"1"
+
+    @staticmethod
+    def kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def stop_worker(self, pid: int):
+        self.retiring.add(pid)
+        self.kill(pid, signal.SIGTERM)
+
+    def restart(self):
+        log.info("Restarting %d workers", len(self.pids))
+        for pid in list(self.pids):
+            new_pid = self.spawn()
+            if not self.wait_ready(new_pid):
+                log.error("Worker %d is not ready in %.0f seconds, keeping "
+                          "the running workers", new_pid, self.ready_timeout)
+                self.stop_worker(new_pid)
+                return
+            self.stop_worker(pid)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+            read_fd = self.pids.pop(pid, None)
+            if read_fd is None:
+                continue
+            os.close(read_fd)
+            uptime = monotonic() - self.started.pop(pid)
+
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                log.info("Worker %d stopped", pid)
+            elif not self.stopping:
+                self.schedule_respawn(pid, status, uptime)
+
+    def schedule_respawn(self, pid: int, status: int, uptime: float):
+        if uptime < MIN_UPTIME:
+            delay = min(RESPAWN_DELAY * 2 ** self.failures, RESPAWN_MAX_DELAY)
+            self.failures += 1
+        else:
+            delay = 0.0
+            self.failures = 0
+
+        log.warning("Worker %d exited with status %d, replacing it in "
+                    "%.0f seconds", pid, status, delay)
+        self.respawns.append(monotonic() + delay)
+        self.respawns.sort()
+
+    def respawn_timeout(self) -> Optional[float]:
+        """Seconds until the next scheduled replacement, None if there is none"""
+        if not self.respawns:
+            return None
+        return max(self.respawns[0] - monotonic(), 0.0)
+
+    def respawn(self):
+        now = monotonic()
+        while self.respawns and self.respawns[0] <= now:
+            self.respawns.pop(0)
+            self.spawn()
+
+    def run(self):
+        # Signals are handled synchronously in the loop below
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.pids or self.respawns:
+            self.respawn()
+            timeout = self.respawn_timeout()
+            if timeout is None:
+                info = signal.sigwaitinfo(SIGNALS)
+            else:
+                info = signal.sigtimedwait(SIGNALS, timeout)
+                if info is None:
+                    continue
+
+            signum = info.si_signo
+            if signum == signal.SIGCHLD:
+                self.reap()
+            elif signum == signal.SIGHUP:
+                for pid in self.pids:
+                    self.kill(pid, signal.SIGHUP)
+            elif signum == signal.SIGUSR2 and not self.stopping:
+                self.restart()
+            elif signum in (signal.SIGINT, signal.SIGTERM):
+                log.info("Stopping %d workers", len(self.pids))
+                self.stopping = True
+                self.respawns.clear()
+                for pid in list(self.pids):
+                    self.stop_worker(pid)
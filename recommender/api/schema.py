@@ -1,6 +1,8 @@
 from marshmallow import Schema
-from marshmallow.fields import Dict, Int, List, Nested, Str
-from marshmallow.validate import Range
+from marshmallow.fields import Bool, Dict, Int, List, Nested, Str
+from marshmallow.validate import Length, Range
+
+from recommender.utils.pg import MAX_INTEGER
 
 
 class ItemSchema(Schema):
@@ -11,14 +13,29 @@ class UserSchema(Schema):
     feature_ids = List(Int(validate=Range(min=1), strict=True), default=[])
 
 
+class InteractionSchema(Schema):
+    user_id = Int(validate=Range(min=0, max=MAX_INTEGER), strict=True,
+                  required=True)
+    item_id = Int(validate=Range(min=0, max=MAX_INTEGER), strict=True,
+                  required=True)
+
+
 class HistoryQSSchema(Schema):
     limit = Int(validate=Range(min=1, max=100), default=10)
+    before = Int(validate=Range(min=1, max=MAX_INTEGER))
+    stream = Bool(default=False)
 
 
 class RecommendationQSSchema(Schema):
     limit = Int(validate=Range(min=1, max=100), default=10)
 
 
+class RecommendationsBatchSchema(Schema):
+    user_ids = List(Int(validate=Range(min=0, max=MAX_INTEGER), strict=True),
+                    validate=Length(min=1, max=1000), required=True)
+    limit = Int(validate=Range(min=1, max=100), default=10)
+
+
 class ErrorSchema(Schema):
     code = Str(required=True)
     message = Str(required=True)
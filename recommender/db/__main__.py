@@ -1,13 +1,20 @@
 import argparse
 import logging
 import os
+import sys
 
 from alembic.config import CommandLine
 
+from recommender.db import partitions
 from recommender.utils.pg import DEFAULT_PG_URL, make_alembic_config
 
 
 def main():
+    # Partition maintenance is not an alembic command
+    if sys.argv[1:2] == ['partitions']:
+        partitions.main(sys.argv[2:])
+        return
+
     logging.basicConfig(level=logging.DEBUG)
 
     alembic = CommandLine()
@@ -0,0 +1,36 @@
+"""Compact feature embeddings
+
+Revision ID: 530bb437c044
+Revises: e6659ab3464d
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '530bb437c044'
+down_revision = 'e6659ab3464d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One-hot embeddings are dropped, trained ones are written by
+    # recommender-cache
+    for table in ('item_features', 'user_features'):
+        op.alter_column(table, 'embedding',
+                        existing_type=sa.ARRAY(sa.Float()),
+                        type_=sa.ARRAY(sa.REAL()),
+                        nullable=True,
+                        postgresql_using='NULL')
+
+
+def downgrade():
+    for table in ('item_features', 'user_features'):
+        op.alter_column(table, 'embedding',
+                        existing_type=sa.ARRAY(sa.REAL()),
+                        type_=sa.ARRAY(sa.Float()),
+                        nullable=False,
+                        postgresql_using="coalesce(embedding, '{}')")
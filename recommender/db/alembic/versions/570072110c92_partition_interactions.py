@@ -0,0 +1,109 @@
+"""Partition interactions by month
+
+Revision ID: 570072110c92
+Revises: a3465de43690
+Create Date: 2026-10-18 19:02:37.604118
+
+"""
+from datetime import date
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '570072110c92'
+down_revision = 'a3465de43690'
+branch_labels = None
+depends_on = None
+
+# Partitions created ahead, later ones are created by
+# `recommender-db partitions`
+MONTHS_AHEAD = 3
+
+
+def add_months(month, n):
+    month_index = month.year * 12 + month.month - 1 + n
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def create_constraints():
+    op.execute(
+        'ALTER SEQUENCE interactions_id_seq OWNED BY interactions.id'
+    )
+    op.create_foreign_key(op.f('fk__interactions__user_id__users'),
+                          'interactions', 'users', ['user_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_foreign_key(op.f('fk__interactions__item_id__items'),
+                          'interactions', 'items', ['item_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_index(op.f('ix__interactions__user_id_id_item_id'),
+                    'interactions', ['user_id', 'id', 'item_id'])
+    op.create_index(op.f('ix__interactions__item_id'),
+                    'interactions', ['item_id'])
+
+
+def upgrade():
+    # The sequence would be dropped along with the table owning it
+    op.execute('ALTER SEQUENCE interactions_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE interactions_partitioned ('
+        "id integer NOT NULL DEFAULT nextval('interactions_id_seq'), "
+        'user_id integer NOT NULL, '
+        'item_id integer NOT NULL, '
+        'created_at timestamp with time zone NOT NULL DEFAULT now()'
+        ') PARTITION BY RANGE (created_at)'
+    )
+
+    # There is no default partition: rows of a month without a partition
+    # are rejected, a default one would block creating it later. Existing
+    # interactions are kept in a partition of their own, before any month.
+    month = date.today().replace(day=1)
+    op.execute(
+        'CREATE TABLE interactions_legacy '
+        'PARTITION OF interactions_partitioned '
+        f"FOR VALUES FROM (MINVALUE) TO ('{month}')"
+    )
+    for n in range(MONTHS_AHEAD + 1):
+        start, end = add_months(month, n), add_months(month, n + 1)
+        op.execute(
+            f'CREATE TABLE interactions_p{start:%Y%m} '
+            f'PARTITION OF interactions_partitioned '
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+    # Time of existing interactions is unknown, they get the epoch, so
+    # retention and training windows treat them as the oldest ones
+    op.execute(
+        'INSERT INTO interactions_partitioned '
+        '(id, user_id, item_id, created_at) '
+        "SELECT id, user_id, item_id, TIMESTAMP WITH TIME ZONE 'epoch' "
+        'FROM interactions'
+    )
+    op.drop_table('interactions')
+    op.rename_table('interactions_partitioned', 'interactions')
+
+    op.create_primary_key(op.f('pk__interactions'), 'interactions',
+                          ['id', 'user_id', 'item_id', 'created_at'])
+    create_constraints()
+
+
+def downgrade():
+    op.execute('ALTER SEQUENCE interactions_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE interactions_plain ('
+        "id integer NOT NULL DEFAULT nextval('interactions_id_seq'), "
+        'user_id integer NOT NULL, '
+        'item_id integer NOT NULL'
+        ')'
+    )
+    op.execute(
+        'INSERT INTO interactions_plain (id, user_id, item_id) '
+        'SELECT id, user_id, item_id FROM interactions'
+    )
+    # Partitions are dropped along with the table
+    op.drop_table('interactions')
+    op.rename_table('interactions_plain', 'interactions')
+
+    op.create_primary_key(op.f('pk__interactions'), 'interactions',
+                          ['id', 'user_id', 'item_id'])
+    create_constraints()
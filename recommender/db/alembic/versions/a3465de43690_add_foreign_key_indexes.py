@@ -0,0 +1,42 @@
+"""Add foreign key indexes
+
+Revision ID: a3465de43690
+Revises: 530bb437c044
+Create Date: 2026-10-18 18:44:05.127391
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3465de43690'
+down_revision = '530bb437c044'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('interactions', ('user_id', 'id', 'item_id')),
+    ('interactions', ('item_id',)),
+    ('user_description', ('user_id',)),
+    ('user_description', ('feature_id',)),
+    ('item_description', ('item_id',)),
+    ('item_description', ('feature_id',)),
+)
+
+
+def index_name(table, columns):
+    return 'ix__{}__{}'.format(table, '_'.join(columns))
+
+
+def upgrade():
+    # Interactions of a user by (user_id, id) cover the history query, the
+    # rest serve joins and cascade deletions
+    for table, columns in INDEXES:
+        op.create_index(op.f(index_name(table, columns)), table,
+                        list(columns))
+
+
+def downgrade():
+    for table, columns in reversed(INDEXES):
+        op.drop_index(op.f(index_name(table, columns)), table_name=table)
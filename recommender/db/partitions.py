@@ -0,0 +1,145 @@
+"""
+Maintenance of monthly partitions of the interactions table: creates
+partitions for the coming months and drops those older than the retention
+period. There is no default partition, so interactions of a month without a
+partition are rejected rather than hidden from later maintenance.
+
+    recommender-db partitions --months-ahead 3 --retention-months 12 \
+        --interval 3600
+"""
+import argparse
+import logging
+import os
+import re
+import time
+from datetime import date
+from typing import List, Optional, Sequence
+
+from sqlalchemy import create_engine, text
+
+from recommender.db.schema import interactions_table
+from recommender.utils.argparse import non_negative_int
+from recommender.utils.pg import DEFAULT_PG_URL
+
+PARTITION_PATTERN = re.compile(
+    r"^{}_p(\d{{4}})(\d{{2}})$".format(interactions_table.name)
+)
+
+# Interactions saved before the table was partitioned, their time is unknown
+# and set to the epoch, so they are the oldest ones
+LEGACY_PARTITION = f"{interactions_table.name}_legacy"
+LEGACY_MONTH = date(1970, 1, 1)
+
+log = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(
+    prog='recommender-db partitions',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+parser.add_argument(
+    '--pg-url', default=os.getenv('RECOMMENDER_PG_URL', DEFAULT_PG_URL),
+    help='Database URL [env var: RECOMMENDER_PG_URL]'
+)
+parser.add_argument('--months-ahead', type=non_negative_int, default=3,
+                    help='Number of months to create partitions for, after '
+                         'the current one')
+parser.add_argument('--retention-months', type=non_negative_int, default=0,
+                    help='Number of past months to keep interactions for, '
+                         '0 keeps all of them')
+parser.add_argument('--interval', type=non_negative_int, default=0,
+                    help='Repeat maintenance every given number of seconds, '
+                         '0 runs it once')
+
+
+def add_months(month: date, n: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + n
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{interactions_table.name}_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """First day of the month stored in the partition, None for others"""
+    if name == LEGACY_PARTITION:
+        return LEGACY_MONTH
+    match = PARTITION_PATTERN.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def list_partitions(conn) -> List[str]:
+    query = text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass) "
+        "ORDER BY child.relname"
+    )
+    return [row[0] for row in conn.execute(query,
+                                           table=interactions_table.name)]
+
+
+def create_partitions(conn, today: date, months_ahead: int):
+    existing = set(list_partitions(conn))
+    month = today.replace(day=1)
+    for n in range(months_ahead + 1):
+        start, end = add_months(month, n), add_months(month, n + 1)
+        name = partition_name(start)
+        if name in existing:
+            continue
+
+        log.info("Creating partition %s", name)
+        conn.execute(
+            f"CREATE TABLE {name} PARTITION OF {interactions_table.name} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+
+def drop_partitions(conn, today: date, retention_months: int):
+    cutoff = add_months(today.replace(day=1), -retention_months)
+    for name in list_partitions(conn):
+        month = partition_month(name)
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+
+        log.info("Dropping partition %s", name)
+        conn.execute(
+            f"ALTER TABLE {interactions_table.name} DETACH PARTITION {name}"
+        )
+        conn.execute(f"DROP TABLE {name}")
+
+
+def maintain_partitions(engine, months_ahead: int, retention_months: int):
+    # Partitions are created in their own transaction, so failing to drop
+    # old ones does not leave the coming months without partitions
+    with engine.begin() as conn:
+        today = conn.execute("SELECT current_date").scalar()
+        create_partitions(conn, today, months_ahead)
+
+    if retention_months > 0:
+        with engine.begin() as conn:
+            drop_partitions(conn, today, retention_months)
+
+
+def main(argv: Sequence[str] = None):
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.pg_url)
+    try:
+        if not args.interval:
+            maintain_partitions(engine, args.months_ahead,
+                                args.retention_months)
+            return
+
+        while True:
+            try:
+                maintain_partitions(engine, args.months_ahead,
+                                    args.retention_months)
+            except Exception:
+                log.exception("Failed to maintain partitions")
+            time.sleep(args.interval)
+    finally:
+        engine.dispose()
@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    MetaData, Table, Column, ForeignKey,
-    ARRAY, Float, Integer, Text
+    MetaData, Table, Column, ForeignKey, Index,
+    ARRAY, DateTime, Integer, REAL, Text, func
 )
 
 convention = {
@@ -31,33 +31,38 @@ interactions_table = Table(
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
-    Column("item_id", Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True),
+    Column("item_id", Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True, index=True),
+    Column("created_at", DateTime(timezone=True), primary_key=True, server_default=func.now()),
+    # Covers user history: latest interactions of a user, index-only
+    Index("ix__interactions__user_id_id_item_id", "user_id", "id", "item_id"),
+    # Monthly partitions are maintained by `recommender-db partitions`
+    postgresql_partition_by="RANGE (created_at)",
 )
 user_features_table = Table(
     "user_features",
     metadata,
     Column("id", Integer, primary_key=True),
     Column("description", Text, nullable=True),
-    Column("embedding", ARRAY(Float), nullable=False),
+    Column("embedding", ARRAY(REAL), nullable=True),
 )
 item_features_table = Table(
     "item_features",
     metadata,
     Column("id", Integer, primary_key=True),
     Column("description", Text, nullable=True),
-    Column("embedding", ARRAY(Float), nullable=False),
+    Column("embedding", ARRAY(REAL), nullable=True),
 )
 user_description_table = Table(
     "user_description",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
-    Column("feature_id", Integer, ForeignKey("user_features.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True),
+    Column("feature_id", Integer, ForeignKey("user_features.id", ondelete="CASCADE"), primary_key=True, index=True),
 )
 item_description_table = Table(
     "item_description",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("item_id", Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True),
-    Column("feature_id", Integer, ForeignKey("item_features.id", ondelete="CASCADE"), primary_key=True),
+    Column("item_id", Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True, index=True),
+    Column("feature_id", Integer, ForeignKey("item_features.id", ondelete="CASCADE"), primary_key=True, index=True),
 )
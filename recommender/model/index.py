@@ -0,0 +1,144 @@
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from recommender.model.scoring import top_k
+
+DEFAULT_N_PROBE = 16
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 256
+ASSIGN_BATCH_SIZE = 65536
+
+log = logging.getLogger(__name__)
+
+
+def augment_items(embeddings: np.ndarray, biases: np.ndarray) -> np.ndarray:
+    """Append biases as an extra component, so the score is a dot product"""
+    return np.hstack([embeddings, biases[:, np.newaxis]]).astype(np.float32)
+
+
+def default_n_lists(n_items: int) -> int:
+    return max(1, int(4 * np.sqrt(n_items)))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for i in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = vectors[i:i + ASSIGN_BATCH_SIZE]
+        distances = norms - 2 * batch @ centroids.T
+        labels[i:i + ASSIGN_BATCH_SIZE] = distances.argmin(axis=1)
+    return labels
+
+
+def kmeans(vectors: np.ndarray, n_lists: int,
+           iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    random = np.random.RandomState(seed)
+    n_sample = min(len(vectors), n_lists * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[random.choice(len(vectors), n_sample, replace=False)]
+    centroids = sample[random.choice(n_sample, n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+
+        # Empty lists are restarted from random points
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        centroids[empty] = sample[random.choice(n_sample, empty.sum())]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index for maximum inner product search over items.
+
+    Items are clustered with k-means, a query is scored exactly against the
+    items of its ``n_probe`` best lists only. Larger ``n_probe`` trades latency
+    for recall.
+    """
+
+    __slots__ = ("centroids", "offsets", "item_rows", "vectors", "n_probe")
+
+    ARRAYS = ("centroids", "offsets", "item_rows", "vectors")
+
+    def __init__(self, centroids, offsets, item_rows, vectors,
+                 n_probe: int = DEFAULT_N_PROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.item_rows = np.asarray(item_rows, dtype=np.int64)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, item_embeddings: np.ndarray, item_biases: np.ndarray,
+              n_lists: int = None, n_probe: int = DEFAULT_N_PROBE,
+              seed: int = 0) -> "IVFIndex":
+        vectors = augment_items(item_embeddings, item_biases)
+        n_lists = min(n_lists or default_n_lists(len(vectors)), len(vectors))
+
+        log.info("Building index with %d lists for %d items",
+                 n_lists, len(vectors))
+        centroids = kmeans(vectors, n_lists, seed=seed)
+        labels = _assign(vectors, centroids)
+
+        # Items of every list are stored contiguously
+        item_rows = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, offsets, item_rows, vectors[item_rows], n_probe)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], n_probe: int = DEFAULT_N_PROBE,
+             mmap_mode: Optional[str] = "r") -> "IVFIndex":
+        path = Path(path)
+        arrays = {
+            name: np.load(str(path / f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in cls.ARRAYS
+        }
+        return cls(n_probe=n_probe, **arrays)
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(str(path / f"{name}.npy"), getattr(self, name))
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def search(self, queries: np.ndarray, k: int,
+               n_probe: int = None) -> np.ndarray:
+        """Item rows of the approximate top-k items for every query"""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        k = min(k, len(self.item_rows))
+        sizes = np.diff(self.offsets)
+        lists = np.argsort(-(queries @ self.centroids.T), axis=1)
+
+        result = np.empty((len(queries), k), dtype=np.int64)
+        for i, query in enumerate(queries):
+            # Probe more lists when the best ones hold less than k items
+            probed = np.cumsum(sizes[lists[i]])
+            n = max(n_probe, int(np.searchsorted(probed, k)) + 1)
+            candidates = np.concatenate([
+                np.arange(self.offsets[j], self.offsets[j + 1])
+                for j in lists[i, :n]
+            ])
+            scores = self.vectors[candidates] @ query
+            best = top_k(scores[np.newaxis], k)[0]
+            result[i] = self.item_rows[candidates[best]]
+        return result
+
+
+def recall_at_k(exact: np.ndarray, approximate: np.ndarray) -> float:
+    """Share of the exact top-k found in the approximate top-k"""
+    hits = sum(
+        len(np.intersect1d(e, a, assume_unique=True))
+        for e, a in zip(exact, approximate)
+    )
+    return hits / exact.size if exact.size else 1.0
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Union
+
+from recommender.model.index import DEFAULT_N_PROBE, IVFIndex
+from recommender.model.scoring import Scorer
+from recommender.model.training import TrainingState
+
+log = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Versions of the trained model on local disk, one directory per version:
+
+        <root>/<version>/scorer/      representations served by the API
+        <root>/<version>/index/       approximate item index, if built
+        <root>/<version>/training/    LightFM model and training state
+        <root>/<version>/metadata.json
+        <root>/latest                 name of the latest version
+
+    A version is written to a temporary directory and renamed when complete,
+    and the latest pointer is replaced atomically, so readers never see
+    partially written artifacts.
+    """
+
+    LATEST_FILENAME = "latest"
+    METADATA_FILENAME = "metadata.json"
+    SCORER_DIRNAME = "scorer"
+    INDEX_DIRNAME = "index"
+    TRAINING_DIRNAME = "training"
+
+    __slots__ = ("root",)
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def path(self, version: str) -> Path:
+        return self.root / version
+
+    def scorer_path(self, version: str) -> Path:
+        return self.path(version) / self.SCORER_DIRNAME
+
+    def index_path(self, version: str) -> Path:
+        return self.path(version) / self.INDEX_DIRNAME
+
+    def training_path(self, version: str) -> Path:
+        return self.path(version) / self.TRAINING_DIRNAME
+
+    def versions(self) -> List[str]:
+        """Complete versions, oldest first"""
+        if not self.root.exists():
+            return []
+        return sorted(
+            path.name for path in self.root.iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        )
+
+    def latest(self) -> Optional[str]:
+        try:
+            return (self.root / self.LATEST_FILENAME).read_text().strip()
+        except FileNotFoundError:
+            return None
+
+    def metadata(self, version: str) -> dict:
+        with (self.path(version) / self.METADATA_FILENAME).open() as f:
+            return json.load(f)
+
+    @staticmethod
+    def new_version() -> str:
+        return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+
+    def save(self, scorer: Scorer, model, state: TrainingState,
+             metadata: dict) -> str:
+        version = self.new_version()
+        tmp_path = self.root / f".{version}"
+        log.info("Saving model version %s", version)
+
+        metadata = dict(
+            metadata,
+            version=version,
+            created_at=datetime.now(timezone.utc).isoformat(),
+            num_users=scorer.num_users,
+            num_items=scorer.num_items,
+            index_lists=scorer.index.n_lists if scorer.index else None,
+            last_interaction_id=state.last_interaction_id,
+        )
+        try:
+            scorer.save(tmp_path / self.SCORER_DIRNAME)
+            if scorer.index is not None:
+                scorer.index.save(tmp_path / self.INDEX_DIRNAME)
+            state.save(tmp_path / self.TRAINING_DIRNAME, model)
+            with (tmp_path / self.METADATA_FILENAME).open("w") as f:
+                json.dump(metadata, f, indent=2)
+            tmp_path.rename(self.path(version))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        log.info("Saved model version %s with %d users and %d items",
+                 version, scorer.num_users, scorer.num_items)
+        return version
+
+    def save_index(self, version: str, index: IVFIndex) -> str:
+        """
+        Save a new version with the artifacts of ``version`` and another
+        index. Files of saved versions are never rewritten, as the API maps
+        them into memory, so the unchanged ones are hard linked.
+        """
+        new_version = self.new_version()
+        tmp_path = self.root / f".{new_version}"
+        log.info("Saving model version %s with the index of %d lists "
+                 "for version %s", new_version, index.n_lists, version)
+
+        metadata = dict(
+            self.metadata(version),
+            version=new_version,
+            created_at=datetime.now(timezone.utc).isoformat(),
+            parent=version,
+            index_lists=index.n_lists,
+        )
+        try:
+            for dirname in (self.SCORER_DIRNAME, self.TRAINING_DIRNAME):
+                shutil.copytree(self.path(version) / dirname,
+                                tmp_path / dirname, copy_function=os.link)
+            index.save(tmp_path / self.INDEX_DIRNAME)
+            with (tmp_path / self.METADATA_FILENAME).open("w") as f:
+                json.dump(metadata, f, indent=2)
+            tmp_path.rename(self.path(new_version))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        log.info("Saved model version %s", new_version)
+        return new_version
+
+    def publish(self, version: str):
+        """Make the version the one loaded by default"""
+        tmp_path = self.root / f".{self.LATEST_FILENAME}"
+        tmp_path.write_text(version)
+        os.replace(str(tmp_path), str(self.root / self.LATEST_FILENAME))
+        log.info("Published model version %s", version)
+
+    def prune(self, keep: int):
+        """Delete all but the ``keep`` newest versions and the latest one"""
+        latest = self.latest()
+        versions = self.versions()
+        for version in versions[:max(len(versions) - keep, 0)]:
+            if version != latest:
+                log.info("Deleting model version %s", version)
+                shutil.rmtree(self.path(version))
+
+    def load_scorer(self, version: str,
+                    n_probe: int = DEFAULT_N_PROBE) -> Scorer:
+        """Memory-mapped scorer of the version, with its index if it has one"""
+        scorer = Scorer.load(self.scorer_path(version))
+        if self.index_path(version).exists():
+            scorer.index = IVFIndex.load(self.index_path(version),
+                                         n_probe=n_probe)
+        return scorer
+
+    def load_training(self, version: str):
+        """LightFM model and training state to continue training from"""
+        return TrainingState.load(self.training_path(version))
@@ -0,0 +1,161 @@
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+# Exact scores are computed for as many users at once as fit this number of
+# float32 scores, so memory does not grow with the number of requested users
+SCORE_CHUNK_SIZE = 1 << 22
+
+log = logging.getLogger(__name__)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores in every row, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+class Scorer:
+    """
+    Trained LightFM representations kept as contiguous float32 arrays.
+
+    Rows of the user and item matrices are addressed by position, ``user_ids``
+    and ``item_ids`` map positions to database identifiers. When ``index`` is
+    set, top-K items are retrieved with it instead of scoring every item.
+    """
+
+    __slots__ = (
+        "user_ids", "user_embeddings", "user_biases",
+        "item_ids", "item_embeddings", "item_biases",
+        "index", "_user_order", "_sorted_user_ids",
+    )
+
+    ARRAYS = (
+        "user_ids", "user_embeddings", "user_biases",
+        "item_ids", "item_embeddings", "item_biases",
+    )
+
+    def __init__(self, user_ids, user_embeddings, user_biases,
+                 item_ids, item_embeddings, item_biases, index=None,
+                 user_order=None):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.user_embeddings = np.ascontiguousarray(user_embeddings,
+                                                    dtype=np.float32)
+        self.user_biases = np.ascontiguousarray(user_biases, dtype=np.float32)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.item_embeddings = np.ascontiguousarray(item_embeddings,
+                                                    dtype=np.float32)
+        self.item_biases = np.ascontiguousarray(item_biases, dtype=np.float32)
+        self.index = index
+
+        if user_order is None:
+            user_order = np.argsort(self.user_ids, kind="stable")
+        self._user_order = np.asarray(user_order, dtype=np.int64)
+        self._sorted_user_ids = self.user_ids[self._user_order]
+
+    @classmethod
+    def from_model(cls, model, user_ids, item_ids,
+                   user_features=None, item_features=None) -> "Scorer":
+        user_biases, user_embeddings = model.get_user_representations(
+            user_features
+        )
+        item_biases, item_embeddings = model.get_item_representations(
+            item_features
+        )
+        return cls(user_ids, user_embeddings, user_biases,
+                   item_ids, item_embeddings, item_biases)
+
+    @classmethod
+    def load(cls, path: Union[str, Path],
+             mmap_mode: Optional[str] = "r") -> "Scorer":
+        """
+        Load arrays saved to a directory. By default they are memory-mapped,
+        so processes loading the same model share its pages.
+        """
+        path = Path(path)
+        arrays = {
+            name: np.load(str(path / f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in cls.ARRAYS + ("user_order",)
+        }
+        return cls(**arrays)
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(str(path / f"{name}.npy"), getattr(self, name))
+        np.save(str(path / "user_order.npy"), self._user_order)
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_ids)
+
+    def user_rows(self, user_ids) -> np.ndarray:
+        """Matrix rows of the given users, -1 for users unknown to the model"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if not self.num_users:
+            return np.full(user_ids.shape, -1, dtype=np.int64)
+
+        pos = np.searchsorted(self._sorted_user_ids, user_ids)
+        pos = np.minimum(pos, self.num_users - 1)
+        found = self._sorted_user_ids[pos] == user_ids
+        return np.where(found, self._user_order[pos], -1)
+
+    def has_user(self, user_id: int) -> bool:
+        return bool(self.user_rows([user_id])[0] >= 0)
+
+    def scores(self, rows: np.ndarray) -> np.ndarray:
+        scores = self.user_embeddings[rows] @ self.item_embeddings.T
+        scores += self.item_biases
+        scores += self.user_biases[rows, np.newaxis]
+        return scores
+
+    def top_k_rows(self, rows: np.ndarray, k: int,
+                   exact: bool = False) -> np.ndarray:
+        """Item rows of the k best items for each of the given rows"""
+        if self.index is None or exact:
+            step = max(1, SCORE_CHUNK_SIZE // max(self.num_items, 1))
+            if len(rows) <= step:
+                return top_k(self.scores(rows), k)
+            return np.concatenate([
+                top_k(self.scores(rows[i:i + step]), k)
+                for i in range(0, len(rows), step)
+            ])
+
+        # User biases do not change the order of items
+        queries = np.hstack([
+            self.user_embeddings[rows],
+            np.ones((len(rows), 1), dtype=np.float32),
+        ])
+        return self.index.search(queries, k)
+
+    def top_k(self, rows: np.ndarray, k: int,
+              exact: bool = False) -> np.ndarray:
+        """Item ids of the k best items for each of the given rows"""
+        return self.item_ids[self.top_k_rows(rows, k, exact)]
+
+    def item_scores(self, rows: np.ndarray,
+                    item_rows: np.ndarray) -> np.ndarray:
+        """Scores of the given items, one row of items per user row"""
+        scores = np.einsum("ij,ikj->ik", self.user_embeddings[rows],
+                           self.item_embeddings[item_rows])
+        scores += self.item_biases[item_rows]
+        scores += self.user_biases[rows, np.newaxis]
+        return scores
+
+    def recommend(self, user_id: int, limit: int) -> Optional[np.ndarray]:
+        row = self.user_rows([user_id])
+        if row[0] < 0:
+            return None
+        return self.top_k(row, limit)[0]
@@ -0,0 +1,146 @@
+import logging
+import pickle
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from scipy import sparse
+
+log = logging.getLogger(__name__)
+
+
+def extend_ids(ids: np.ndarray, new_ids) -> np.ndarray:
+    """Append identifiers missing from ``ids``, keeping existing positions"""
+    new_ids = np.unique(np.asarray(new_ids, dtype=np.int64))
+    missing = new_ids[~np.isin(new_ids, ids)]
+    return np.concatenate([ids, missing]) if len(missing) else ids
+
+
+def positions(ids: np.ndarray, values) -> np.ndarray:
+    """Positions of ``values`` in ``ids``, every value has to be present"""
+    order = np.argsort(ids, kind="stable")
+    return order[np.searchsorted(ids, values, sorter=order)]
+
+
+def incidence_matrix(rows, cols, shape) -> sparse.coo_matrix:
+    return sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape
+    )
+
+
+def grow_model(model, n_user_features: int, n_item_features: int):
+    """
+    Add parameters for new user and item features to a fitted LightFM model,
+    initialized the same way LightFM initializes a fresh model.
+    """
+    gradient = 1.0 if model.learning_schedule == "adagrad" else 0.0
+    shape = {"user": n_user_features, "item": n_item_features}
+
+    for prefix, n_features in shape.items():
+        embeddings = getattr(model, f"{prefix}_embeddings")
+        extra = n_features - embeddings.shape[0]
+        if extra <= 0:
+            continue
+
+        log.info("Growing %s features by %d", prefix, extra)
+        new = model.random_state.rand(extra, model.no_components) - 0.5
+        new = (new / model.no_components).astype(np.float32)
+        values = {
+            "embeddings": new,
+            "embedding_gradients": np.full_like(new, gradient),
+            "embedding_momentum": np.zeros_like(new),
+            "biases": np.zeros(extra, dtype=np.float32),
+            "bias_gradients": np.full(extra, gradient, dtype=np.float32),
+            "bias_momentum": np.zeros(extra, dtype=np.float32),
+        }
+        for name, value in values.items():
+            attr = f"{prefix}_{name}"
+            setattr(model, attr, np.concatenate([getattr(model, attr), value]))
+
+
+class TrainingState:
+    """
+    Everything needed to continue training a persisted model: id mappings of
+    matrix rows and columns, item features and the id of the last interaction
+    the model has seen.
+    """
+
+    MODEL_FILENAME = "lightfm.pkl"
+    STATE_FILENAME = "state.npz"
+    ITEM_FEATURES_FILENAME = "item_features.npz"
+
+    __slots__ = (
+        "user_ids", "item_ids", "feature_ids",
+        "item_features", "last_interaction_id",
+    )
+
+    def __init__(self, user_ids, item_ids, feature_ids, item_features,
+                 last_interaction_id: int = 0):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int64)
+        self.item_features = sparse.csr_matrix(item_features,
+                                               dtype=np.float32)
+        self.last_interaction_id = int(last_interaction_id)
+
+    @classmethod
+    def load(cls, model_dir: Union[str, Path]):
+        model_dir = Path(model_dir)
+        with (model_dir / cls.MODEL_FILENAME).open("rb") as f:
+            model = pickle.load(f)
+        item_features = sparse.load_npz(
+            str(model_dir / cls.ITEM_FEATURES_FILENAME)
+        )
+        with np.load(str(model_dir / cls.STATE_FILENAME)) as data:
+            state = cls(item_features=item_features, **data)
+        return model, state
+
+    def save(self, model_dir: Union[str, Path], model):
+        model_dir = Path(model_dir)
+        model_dir.mkdir(parents=True, exist_ok=True)
+        with (model_dir / self.MODEL_FILENAME).open("wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        sparse.save_npz(str(model_dir / self.ITEM_FEATURES_FILENAME),
+                        self.item_features)
+        np.savez(
+            str(model_dir / self.STATE_FILENAME),
+            user_ids=self.user_ids,
+            item_ids=self.item_ids,
+            feature_ids=self.feature_ids,
+            last_interaction_id=self.last_interaction_id,
+        )
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.item_ids)
+
+    def add_users(self, user_ids):
+        self.user_ids = extend_ids(self.user_ids, user_ids)
+
+    def add_items(self, item_ids, feature_item_ids, feature_ids):
+        """
+        Register new items along with their (item_id, feature_id) pairs.
+        Features of already known items are left as they are.
+        """
+        n_items, n_features = len(self.item_ids), len(self.feature_ids)
+        self.item_ids = extend_ids(self.item_ids, item_ids)
+        self.feature_ids = extend_ids(self.feature_ids, feature_ids)
+
+        rows = positions(self.item_ids, feature_item_ids)
+        cols = positions(self.feature_ids, feature_ids)
+        new = rows >= n_items
+        features = incidence_matrix(
+            rows[new], cols[new], (len(self.item_ids), len(self.feature_ids))
+        )
+
+        known = self.item_features.tocoo()
+        known.resize(len(self.item_ids), len(self.feature_ids))
+        self.item_features = (known + features).tocsr()
+        log.info("Added %d items and %d features",
+                 len(self.item_ids) - n_items,
+                 len(self.feature_ids) - n_features)
+
+    def interactions(self, user_ids, item_ids) -> sparse.coo_matrix:
+        rows = positions(self.user_ids, user_ids)
+        cols = positions(self.item_ids, item_ids)
+        return incidence_matrix(rows, cols, self.shape)
@@ -1,24 +1,56 @@
 import argparse
 import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 from aiomisc.log import LogFormat, basic_config
 from configargparse import ArgumentParser
 from lightfm import LightFM
-from lightfm.datasets import fetch_stackexchange
 from lightfm.evaluation import auc_score
-from sqlalchemy import create_engine, select
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.sql import column, table
 from redis import Redis
 from yarl import URL
 
-from recommender.utils.argparse import clear_environ, positive_int
-from recommender.utils.pg import DEFAULT_PG_URL
-from recommender.utils.redis import DEFAULT_REDIS_URL
+from recommender.db.schema import (
+    users_table,
+    items_table,
+    interactions_table,
+    item_features_table,
+    item_description_table,
+)
+from recommender.model.index import DEFAULT_N_PROBE, IVFIndex
+from recommender.model.registry import ModelRegistry
+from recommender.model.scoring import Scorer
+from recommender.model.training import (
+    TrainingState, grow_model, incidence_matrix, positions
+)
+from recommender.utils.argparse import (
+    clear_environ, non_negative_int, positive_int
+)
+from recommender.utils.cache import ITEM_KEY_PATTERN
+from recommender.utils.model import DEFAULT_MODEL_DIR
+from recommender.utils.pg import DEFAULT_PG_URL, FETCH_SIZE, fetch_array
+from recommender.utils.pgcopy import (
+    FLOAT4_OID, FloatArrayColumn, IntColumn, copy_from
+)
+from recommender.utils.redis import (
+    DEFAULT_REDIS_URL, GENERATION_COUNTER_KEY, GENERATION_KEY,
+    GENERATION_PATTERN, ITEM_DTYPE, SCORE_DTYPE, USERS_BUILD_KEY, USERS_KEY,
+    USERS_READY_KEY, latest_key, parse_generation, recommendations_key,
+    scores_key,
+)
 
 ENV_VAR_PREFIX = 'RECOMMENDER_'
 
 NUM_THREADS = 1
 NUM_COMPONENTS = 30
 NUM_EPOCHS = 30
+TEST_FRACTION = 0.1
 ITEM_ALPHA = 1e-6
 
 log = logging.getLogger(__name__)
@@ -31,12 +63,51 @@ parser = ArgumentParser(
 group = parser.add_argument_group('PostgreSQL options')
 group.add_argument('--pg-url', type=URL, default=URL(DEFAULT_PG_URL),
                    help='URL to use to connect to the database')
+group.add_argument('--pg-fetch-size', type=positive_int, default=FETCH_SIZE,
+                   help='Number of rows fetched from a cursor at once')
 
 group = parser.add_argument_group('Redis options')
 group.add_argument('--redis-url', type=URL, default=URL(DEFAULT_REDIS_URL),
                    help='URL to use to connect to the cache')
 group.add_argument("--redis-ttl", type=positive_int, default=3600,
                    help="TTL for cached values")
+group.add_argument('--redis-scores', action='store_true',
+                   help='Also cache float16 scores of recommended items')
+
+group.add_argument('--redis-batch-size', type=positive_int, default=10000,
+                   help='Number of users whose predictions are sent to Redis '
+                        'in one pipeline')
+
+group = parser.add_argument_group('Training options')
+group.add_argument('--incremental', action='store_true',
+                   help='Update the saved model with interactions added '
+                        'since it was trained instead of training a new one')
+group.add_argument('--incremental-epochs', type=positive_int, default=5,
+                   help='Number of epochs to fit new interactions for')
+group.add_argument('--training-window', type=non_negative_int, default=0,
+                   help='Train a new model on interactions of the given '
+                        'number of recent days only, 0 uses all of them')
+
+group = parser.add_argument_group('Model options')
+group.add_argument('--model-dir', type=Path, default=Path(DEFAULT_MODEL_DIR),
+                   help='Directory of the model registry')
+group.add_argument('--keep-models', type=positive_int, default=3,
+                   help='Number of model versions kept in the registry')
+group.add_argument('--ann-lists', type=non_negative_int, default=0,
+                   help='Number of lists of the approximate item index, '
+                        '0 disables the index')
+group.add_argument('--ann-probes', type=positive_int, default=DEFAULT_N_PROBE,
+                   help='Number of index lists to scan per user')
+
+group = parser.add_argument_group('Prediction options')
+group.add_argument('--predict-workers', type=positive_int,
+                   default=os.cpu_count() or 1,
+                   help='Number of processes to score users with')
+group.add_argument('--predict-batch-size', type=positive_int, default=1024,
+                   help='Number of users scored with one matrix multiply')
+group.add_argument('--predict-prefetch', type=positive_int, default=2,
+                   help='Number of batches scored ahead per process, bounds '
+                        'memory held by predictions not yet cached')
 
 group = parser.add_argument_group('Logging options')
 group.add_argument('--log-level', default='info',
@@ -45,27 +116,87 @@ group.add_argument('--log-format', choices=LogFormat.choices(),
                    default='color')
 
 
-def fetch_training_data():
-    log.info("Fetching training data")
+def fetch_last_interaction_id(conn):
+    query = select([func.coalesce(func.max(interactions_table.c.id), 0)])
+    return conn.execute(query).scalar()
+
+
+def fetch_ids(conn, table, fetch_size):
+    query = select([table.c.id]).order_by(table.c.id)
+    return fetch_array(conn, query, fetch_size)[:, 0]
+
 
-    data = fetch_stackexchange("crossvalidated",
-                               test_set_fraction=0.1,
-                               indicator_features=False,
-                               tag_features=True)
-    train = data["train"]
-    test = data["test"]
-    user_features = None
-    item_features = data["item_features"]
+def fetch_new_interactions(conn, last_interaction_id, fetch_size):
+    log.info(f"Fetching interactions after {last_interaction_id}")
+    query = select([
+        interactions_table.c.id,
+        interactions_table.c.user_id,
+        interactions_table.c.item_id,
+    ]).where(
+        interactions_table.c.id > last_interaction_id
+    ).order_by(
+        interactions_table.c.id
+    )
+    rows = fetch_array(conn, query, fetch_size)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
 
-    # Remove duplicated train values from test set
-    t1 = set(zip(*train.nonzero()))
-    t2 = set(zip(*test.nonzero()))
-    test = test.tocsr()
-    for idx in t1 & t2:
-        test[idx] = 0
-    test = test.tocoo()
 
-    return train, test, user_features, item_features
+def fetch_item_features(conn, item_ids, fetch_size):
+    query = select([
+        item_description_table.c.item_id,
+        item_description_table.c.feature_id,
+    ])
+    if item_ids is not None:
+        query = query.where(
+            item_description_table.c.item_id.in_(item_ids.tolist())
+        )
+    rows = fetch_array(conn, query, fetch_size)
+    return rows[:, 0], rows[:, 1]
+
+
+def split_interactions(interactions, test_fraction):
+    # Converting to CSR merges duplicated interactions
+    interactions = interactions.tocsr().tocoo()
+    test = np.random.RandomState(0).rand(interactions.nnz) < test_fraction
+
+    def subset(mask):
+        return incidence_matrix(interactions.row[mask],
+                                interactions.col[mask],
+                                interactions.shape)
+
+    return subset(~test), subset(test)
+
+
+def fetch_training_data(conn, last_interaction_id, fetch_size, since=None):
+    log.info("Fetching training data")
+    user_ids = fetch_ids(conn, users_table, fetch_size)
+    item_ids = fetch_ids(conn, items_table, fetch_size)
+    feature_ids = fetch_ids(conn, item_features_table, fetch_size)
+
+    rows, cols = fetch_item_features(conn, None, fetch_size)
+    item_features = incidence_matrix(positions(item_ids, rows),
+                                     positions(feature_ids, cols),
+                                     (len(item_ids), len(feature_ids)))
+    state = TrainingState(user_ids, item_ids, feature_ids, item_features,
+                          last_interaction_id)
+
+    query = select([
+        interactions_table.c.user_id,
+        interactions_table.c.item_id,
+    ]).where(
+        interactions_table.c.id <= last_interaction_id
+    )
+    if since is not None:
+        # Older partitions are not scanned
+        log.info(f"Fetching interactions since {since}")
+        query = query.where(interactions_table.c.created_at >= since)
+    rows = fetch_array(conn, query, fetch_size)
+    train, test = split_interactions(
+        state.interactions(rows[:, 0], rows[:, 1]), TEST_FRACTION
+    )
+    log.info(f"Fetched {train.nnz + test.nnz} interactions of "
+             f"{len(state.user_ids)} users with {len(state.item_ids)} items")
+    return train, test, None, state
 
 
 def train_model(train, test, user_features, item_features):
@@ -95,60 +226,215 @@ def train_model(train, test, user_features, item_features):
                          item_features=item_features,
                          num_threads=NUM_THREADS).mean()
     log.info(f"Test set AUC: {test_auc}")
+    return model, {"train_auc": float(train_auc), "test_auc": float(test_auc)}
+
+
+_scorer = None
+
+
+def update_model(conn, model, state, epochs, fetch_size):
+    interaction_ids, user_ids, item_ids = fetch_new_interactions(
+        conn, state.last_interaction_id, fetch_size
+    )
+    if not len(interaction_ids):
+        log.info("No new interactions, model is up to date")
+        return model
+
+    state.add_users(user_ids)
+    new_items = np.setdiff1d(item_ids, state.item_ids)
+    state.add_items(new_items,
+                    *fetch_item_features(conn, new_items, fetch_size))
+    grow_model(model, len(state.user_ids), len(state.feature_ids))
+
+    log.info(f"Updating model with {len(interaction_ids)} interactions")
+    model = model.fit_partial(state.interactions(user_ids, item_ids),
+                              item_features=state.item_features,
+                              epochs=epochs,
+                              num_threads=NUM_THREADS)
+    state.last_interaction_id = int(interaction_ids[-1])
     return model
 
 
-def fetch_latest_items():
-    log.info("Fetching latest items")
-    data = fetch_stackexchange("crossvalidated",
-                               test_set_fraction=0.1,
-                               indicator_features=False,
-                               tag_features=True)
-    train = data["train"]
-    return list(reversed(range(train.shape[1])))
-
-
-def fetch_active_users():
-    log.info("Fetching active users")
-    data = fetch_stackexchange("crossvalidated",
-                               test_set_fraction=0.1,
-                               indicator_features=False,
-                               tag_features=True)
-    train = data["train"]
-    return list(reversed(range(train.shape[0])))
-
-
-def predict(model, user_ids, item_ids, user_features, item_features, limit=100):
-    log.info("Predicting")
-    predictions = {}
-    for user_id in user_ids:
-        pred = model.predict(user_ids=user_id,
-                             item_ids=item_ids,
-                             user_features=user_features,
-                             item_features=item_features)
-        pred = pred.argsort()[-limit:][::-1]
-        predictions[user_id] = pred.tolist()
-        log.debug(f"Predicted for user {user_id}")
-    log.info(f"Predicted for {len(predictions)} users")
-    return predictions
-
-
-def cache_predictions(conn, predictions, ttl):
+def save_feature_embeddings(conn, feature_ids, embeddings):
+    log.info(f"Saving embeddings of {len(feature_ids)} item features")
+    conn.execute(
+        "CREATE TEMPORARY TABLE feature_embeddings "
+        "(id integer, embedding real[]) ON COMMIT DROP"
+    )
+    embeddings_table = table("feature_embeddings",
+                             column("id"), column("embedding"))
+    copy_from(conn.connection, embeddings_table.name, ["id", "embedding"],
+              [IntColumn(feature_ids),
+               FloatArrayColumn(embeddings, FLOAT4_OID)])
+
+    query = item_features_table.update().values(
+        embedding=embeddings_table.c.embedding
+    ).where(
+        item_features_table.c.id == embeddings_table.c.id
+    )
+    conn.execute(query)
+
+
+def _init_predict_worker(scorer):
+    global _scorer
+    _scorer = scorer
+
+
+def _predict_block(user_ids, limit, with_scores):
+    rows = _scorer.user_rows(user_ids)
+    rows = rows[rows >= 0]
+    item_rows = _scorer.top_k_rows(rows, limit)
+    scores = None
+    if with_scores:
+        scores = _scorer.item_scores(rows, item_rows).astype(SCORE_DTYPE)
+    items = _scorer.item_ids[item_rows].astype(ITEM_DTYPE)
+    return _scorer.user_ids[rows], items, scores
+
+
+def predict(scorer, user_ids, limit=100, batch_size=1024, workers=1,
+            prefetch=2, with_scores=False):
+    """
+    Top items of every user known to the model, yielded in blocks of user
+    ids, packed item ids and scores (when requested). At most ``prefetch``
+    blocks per worker are scored ahead of the consumer.
+    """
+    log.info(f"Predicting with {workers} workers")
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    blocks = (
+        user_ids[i:i + batch_size]
+        for i in range(0, len(user_ids), batch_size)
+    )
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_predict_worker,
+                                 initargs=(scorer,)) as executor:
+            pending = deque()
+            for block in blocks:
+                pending.append(executor.submit(_predict_block, block,
+                                               limit, with_scores))
+                if len(pending) >= workers * prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        _init_predict_worker(scorer)
+        for block in blocks:
+            yield _predict_block(block, limit, with_scores)
+
+
+def build_index(scorer, n_lists, n_probe):
+    index = IVFIndex.build(scorer.item_embeddings, scorer.item_biases,
+                           n_lists=n_lists, n_probe=n_probe)
+    log.info(f"Built index with {index.n_lists} lists")
+    return index
+
+
+def new_generation(conn):
+    generation = conn.incr(GENERATION_COUNTER_KEY)
+    log.info(f"Writing cache generation {generation}")
+    return generation
+
+
+def publish_generation(conn, generation):
+    """Point readers to the new generation, returns the previous one"""
+    previous = conn.getset(GENERATION_KEY, generation)
+    log.info(f"Published cache generation {generation}")
+    return int(previous) if previous is not None else None
+
+
+def unlink_keys(conn, keys, batch_size=1000):
+    """Unlink keys in batches, returns the number of deleted ones"""
+    deleted = 0
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += conn.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += conn.unlink(*batch)
+    return deleted
+
+
+def collect_generations(conn, keep, batch_size=1000):
+    """
+    Unlink keys of generations older than ``keep``. The previous generation
+    is kept, as API processes switch to a new one with a delay.
+    """
+    log.info(f"Deleting cache generations older than {keep}")
+    keys = (
+        key
+        for key in conn.scan_iter(match=GENERATION_PATTERN, count=batch_size)
+        if parse_generation(key) < keep
+    )
+    deleted = unlink_keys(conn, keys, batch_size)
+    log.info(f"Deleted {deleted} keys of old cache generations")
+
+
+def invalidate_items(conn, batch_size=1000):
+    """Unlink cached items, as their embeddings were replaced"""
+    log.info("Invalidating cached items")
+    keys = conn.scan_iter(match=ITEM_KEY_PATTERN, count=batch_size)
+    deleted = unlink_keys(conn, keys, batch_size)
+    log.info(f"Invalidated {deleted} cached items")
+
+
+def cache_predictions(conn, generation, blocks, total, ttl,
+                      batch_size=10000):
+    """Cache predicted blocks, sending a pipeline every batch_size users"""
     log.info("Caching predictions")
+    pipe = conn.pipeline(transaction=False)
+    cached = queued = 0
+    for user_ids, items, scores in blocks:
+        for i, user_id in enumerate(user_ids.tolist()):
+            pipe.set(recommendations_key(generation, user_id),
+                     items[i].tobytes(), ex=ttl)
+            if scores is not None:
+                pipe.set(scores_key(generation, user_id),
+                         scores[i].tobytes(), ex=ttl)
+        queued += len(user_ids)
+
+        if queued >= batch_size:
+            pipe.execute()
+            cached += queued
+            queued = 0
+            log.info(f"Cached predictions for {cached} of {total} users")
+
+    pipe.execute()
+    cached += queued
+    log.info(f"Cached predictions for {cached} users")
+
+
+def reset_users(conn):
+    # Called before user ids are read: changes made by the API from now on
+    # are mirrored to the new set
+    conn.delete(USERS_BUILD_KEY)
+
+
+def cache_users(conn, user_ids, chunk_size=10000):
+    log.info("Caching user ids")
+    pipe = conn.pipeline(transaction=False)
+    for start in range(0, len(user_ids), chunk_size):
+        pipe.sadd(USERS_BUILD_KEY, *user_ids[start:start + chunk_size])
+    pipe.execute()
+
+    # The new set replaces the old one atomically, so users deleted since
+    # the last run are dropped. SUNIONSTORE unlike RENAME does not fail if
+    # the new set is empty.
     pipe = conn.pipeline()
-    for user_id, pred in predictions.items():
-        pipe.rpush(f"{user_id}", *pred)
-        pipe.expire(f"{user_id}", ttl)
+    pipe.sunionstore(USERS_KEY, USERS_BUILD_KEY)
+    pipe.delete(USERS_BUILD_KEY)
+    pipe.set(USERS_READY_KEY, 1)
     pipe.execute()
-    log.info(f"Cached predictions for {len(predictions)} users")
+    log.info(f"Cached {len(user_ids)} user ids")
 
 
-def cache_latest_items(conn, items, ttl):
+def cache_latest_items(conn, generation, items, ttl):
     log.info("Caching latest items")
     pipe = conn.pipeline()
-    pipe.delete("latest")
-    pipe.sadd("latest", *items)
-    pipe.expire("latest", ttl)
+    pipe.sadd(latest_key(generation), *items)
+    pipe.expire(latest_key(generation), ttl)
     pipe.execute()
     log.info(f"Cached {len(items)} latest items")
 
@@ -159,21 +445,81 @@ def main():
 
     basic_config(args.log_level, args.log_format, buffered=True)
 
-    # engine = create_engine(args.pg_url)
-    # try:
-    #     with engine.begin() as conn:
-    users = fetch_active_users()
-    items = fetch_latest_items()
-    train, test, user_features, item_features = fetch_training_data()
-    # finally:
-    #     engine.dispose()
+    registry = ModelRegistry(args.model_dir)
+    parent = registry.latest()
+    incremental = args.incremental and parent is not None
+    if args.incremental and not incremental:
+        log.warning(f"No model to update in {args.model_dir}, "
+                    f"training a new one")
+
+    metadata = {"parent": parent if incremental else None}
+
+    with Redis.from_url(str(args.redis_url)) as r:
+        reset_users(r)
+
+    # Row counts taken to preallocate arrays have to match streamed rows
+    engine = create_engine(str(args.pg_url), isolation_level="REPEATABLE READ")
+    try:
+        with engine.begin() as conn:
+            if incremental:
+                model, state = registry.load_training(parent)
+                model = update_model(conn, model, state,
+                                     args.incremental_epochs,
+                                     args.pg_fetch_size)
+            else:
+                since = None
+                if args.training_window > 0:
+                    since = datetime.now(timezone.utc) - timedelta(
+                        days=args.training_window
+                    )
+                train, test, user_features, state = fetch_training_data(
+                    conn, fetch_last_interaction_id(conn),
+                    args.pg_fetch_size, since
+                )
+            known_users = fetch_ids(conn, users_table, args.pg_fetch_size)
+
+        if not incremental:
+            model, metrics = train_model(train, test, user_features,
+                                         state.item_features)
+            metadata.update(metrics)
+
+        with engine.begin() as conn:
+            save_feature_embeddings(conn, state.feature_ids,
+                                    model.item_embeddings)
+    finally:
+        engine.dispose()
+
+    # Cached items include embeddings of their features
+    with Redis.from_url(str(args.redis_url)) as r:
+        invalidate_items(r)
+
+    scorer = Scorer.from_model(model, state.user_ids, state.item_ids,
+                               item_features=state.item_features)
+    if args.ann_lists > 0:
+        scorer.index = build_index(scorer, args.ann_lists, args.ann_probes)
+
+    version = registry.save(scorer, model, state, metadata)
+    registry.publish(version)
+    registry.prune(args.keep_models)
 
-    model = train_model(train, test, user_features, item_features)
-    predictions = predict(model, users, items, user_features, item_features)
+    users = state.user_ids[::-1]
+    latest_items = np.sort(state.item_ids)[::-1].tolist()
+    blocks = predict(scorer, users,
+                     batch_size=args.predict_batch_size,
+                     workers=args.predict_workers,
+                     prefetch=args.predict_prefetch,
+                     with_scores=args.redis_scores)
 
     with Redis.from_url(str(args.redis_url)) as r:
-        cache_predictions(r, predictions, args.redis_ttl)
-        cache_latest_items(r, items[:100], args.redis_ttl)
+        generation = new_generation(r)
+        cache_predictions(r, generation, blocks, len(users), args.redis_ttl,
+                          args.redis_batch_size)
+        cache_latest_items(r, generation, latest_items[:100], args.redis_ttl)
+        cache_users(r, known_users.tolist())
+
+        previous = publish_generation(r, generation)
+        if previous is not None:
+            collect_generations(r, keep=previous)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,22 @@
 import argparse
 import logging
+from contextlib import ExitStack, contextmanager
 
 from aiomisc.log import LogFormat, basic_config
 from configargparse import ArgumentParser
 from lightfm import LightFM
 from lightfm.datasets import fetch_stackexchange
 from lightfm.evaluation import auc_score
+import numpy as np
 from sqlalchemy import create_engine, select
+from sqlalchemy.schema import (
+    AddConstraint, CreateIndex, DropConstraint, DropIndex
+)
 from redis import Redis
 from yarl import URL
 
 from recommender.db.schema import (
+    metadata,
     users_table,
     items_table,
     interactions_table,
@@ -18,7 +24,8 @@ from recommender.db.schema import (
     item_description_table,
 )
 from recommender.utils.argparse import clear_environ, positive_int
-from recommender.utils.pg import DEFAULT_PG_URL, MAX_QUERY_ARGS
+from recommender.utils.pg import DEFAULT_PG_URL
+from recommender.utils.pgcopy import IntColumn, TextColumn, copy_from
 from recommender.utils.redis import DEFAULT_REDIS_URL
 
 ENV_VAR_PREFIX = 'RECOMMENDER_'
@@ -39,6 +46,11 @@ group = parser.add_argument_group('PostgreSQL options')
 group.add_argument('--pg-url', type=URL, default=URL(DEFAULT_PG_URL),
                    help='URL to use to connect to the database')
 
+group = parser.add_argument_group('Loading options')
+group.add_argument('--defer-constraints', action='store_true',
+                   help='Drop keys and indexes before loading and create '
+                        'them afterwards, for loading into empty tables')
+
 group = parser.add_argument_group('Logging options')
 group.add_argument('--log-level', default='info',
                    choices=('debug', 'info', 'warning', 'error', 'fatal'))
@@ -68,67 +80,73 @@ def fetch_dataset():
     return train, test, item_features, item_feature_labels
 
 
+@contextmanager
+def deferred_constraints(conn):
+    """Drop keys and indexes for the time of a bulk load, then rebuild them"""
+    tables = metadata.sorted_tables
+    foreign_keys = [c for t in tables for c in t.foreign_key_constraints]
+    indexes = [i for t in tables for i in t.indexes]
+    primary_keys = [t.primary_key for t in tables]
+
+    log.info("Dropping constraints and indexes")
+    for constraint in foreign_keys:
+        conn.execute(DropConstraint(constraint))
+    for index in indexes:
+        conn.execute(DropIndex(index))
+    for constraint in primary_keys:
+        conn.execute(DropConstraint(constraint))
+
+    yield
+
+    log.info("Creating constraints and indexes")
+    for constraint in primary_keys:
+        conn.execute(AddConstraint(constraint))
+    for index in indexes:
+        conn.execute(CreateIndex(index))
+    for constraint in foreign_keys:
+        conn.execute(AddConstraint(constraint))
+
+
 def fill_users_table(conn, matrix):
     log.info(f"Filling 'users' table")
-    users = [{"id": i} for i in range(matrix.shape[0])]
-    batch_size = MAX_QUERY_ARGS // len(users_table.c)
-    for i in range(0, len(users), batch_size):
-        query = users_table.insert().values(users[i:i+batch_size])
-        conn.execute(query)
+    copy_from(conn.connection, users_table.name, ["id"],
+              [IntColumn(np.arange(matrix.shape[0]))])
 
 
 def fill_items_table(conn, matrix):
     log.info(f"Filling 'items' table")
-    items = [{"id": i} for i in range(matrix.shape[1])]
-    batch_size = MAX_QUERY_ARGS // len(items_table.c)
-    for i in range(0, len(items), batch_size):
-        query = items_table.insert().values(items[i:i+batch_size])
-        conn.execute(query)
+    copy_from(conn.connection, items_table.name, ["id"],
+              [IntColumn(np.arange(matrix.shape[1]))])
 
 
 def fill_interactions_table(conn, matrix):
     log.info(f"Filling 'interactions' table")
-
-    interactions = []
     rows, cols = matrix.nonzero()
-    for u, i in zip(rows, cols):
-        interactions.append({"user_id": int(u), "item_id": int(i)})
-
-    batch_size = MAX_QUERY_ARGS // len(interactions_table.c)
-    for i in range(0, len(interactions), batch_size):
-        query = interactions_table.insert().values(interactions[i:i+batch_size])
-        conn.execute(query)
+    copy_from(conn.connection, interactions_table.name,
+              ["user_id", "item_id"], [IntColumn(rows), IntColumn(cols)])
 
 
 def fill_item_features_table(conn, matrix, labels):
     log.info(f"Filling 'item_features' table")
-
-    item_features = [
-        {
-            "id": i,
-            "description": labels[i],
-            "embedding": [0 for _ in range(i)] + [1] + [0 for _ in range(i + 1, matrix.shape[1])]
-        }
-        for i in range(matrix.shape[1])
-    ]
-    batch_size = MAX_QUERY_ARGS // len(item_features_table.c)
-    for i in range(0, len(item_features), batch_size):
-        query = item_features_table.insert().values(item_features[i:i + batch_size])
-        conn.execute(query)
+    # Embeddings are left empty until recommender-cache trains the model
+    n_features = matrix.shape[1]
+    copy_from(conn.connection, item_features_table.name,
+              ["id", "description"],
+              [IntColumn(np.arange(n_features)),
+               TextColumn(labels[:n_features])])
 
 
 def fill_item_descriptions_table(conn, matrix):
     log.info(f"Filling 'item_description' table")
-
-    item_descriptions = []
     rows, cols = matrix.nonzero()
-    for i, f in zip(rows, cols):
-        item_descriptions.append({"item_id": int(i), "feature_id": int(f)})
+    copy_from(conn.connection, item_description_table.name,
+              ["item_id", "feature_id"], [IntColumn(rows), IntColumn(cols)])
+
 
-    batch_size = MAX_QUERY_ARGS // len(item_description_table.c)
-    for i in range(0, len(item_descriptions), batch_size):
-        query = item_description_table.insert().values(item_descriptions[i:i + batch_size])
-        conn.execute(query)
+def analyze_tables(conn):
+    log.info("Analyzing tables")
+    for table in metadata.sorted_tables:
+        conn.execute(f"ANALYZE {table.name}")
 
 
 def main():
@@ -141,11 +159,16 @@ def main():
     engine = create_engine(str(args.pg_url))
     try:
         with engine.begin() as conn:
-            fill_users_table(conn, train)
-            fill_items_table(conn, train)
-            fill_interactions_table(conn, train)
-            fill_interactions_table(conn, test)
-            fill_item_features_table(conn, item_features, item_feature_labels)
-            fill_item_descriptions_table(conn, item_features)
+            with ExitStack() as stack:
+                if args.defer_constraints:
+                    stack.enter_context(deferred_constraints(conn))
+                fill_users_table(conn, train)
+                fill_items_table(conn, train)
+                fill_interactions_table(conn, train)
+                fill_interactions_table(conn, test)
+                fill_item_features_table(conn, item_features,
+                                         item_feature_labels)
+                fill_item_descriptions_table(conn, item_features)
+            analyze_tables(conn)
     finally:
         engine.dispose()
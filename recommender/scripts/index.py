@@ -0,0 +1,106 @@
+import argparse
+import logging
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from aiomisc.log import LogFormat, basic_config
+from configargparse import ArgumentParser
+
+from recommender.model.index import IVFIndex, recall_at_k
+from recommender.model.registry import ModelRegistry
+from recommender.utils.argparse import clear_environ, positive_int
+from recommender.utils.model import DEFAULT_MODEL_DIR
+
+ENV_VAR_PREFIX = 'RECOMMENDER_'
+
+log = logging.getLogger(__name__)
+
+parser = ArgumentParser(
+    auto_env_var_prefix=ENV_VAR_PREFIX, allow_abbrev=False,
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+
+group = parser.add_argument_group('Model options')
+group.add_argument('--model-dir', type=Path, default=Path(DEFAULT_MODEL_DIR),
+                   help='Directory of the model registry')
+group.add_argument('--version',
+                   help='Model version to evaluate, the latest by default')
+group.add_argument('--ann-lists', type=positive_int,
+                   help='Build a new index with the given number of lists '
+                        'instead of loading the saved one')
+group.add_argument('--save', action='store_true',
+                   help='Save the newly built index as a new model version, '
+                        'published if built for the latest one')
+
+group = parser.add_argument_group('Report options')
+group.add_argument('--k', type=positive_int, default=100,
+                   help='Number of items to retrieve per user')
+group.add_argument('--users', type=positive_int, default=1000,
+                   help='Number of randomly sampled users to evaluate')
+group.add_argument('--probes', type=positive_int, nargs='+',
+                   default=[1, 2, 4, 8, 16, 32, 64],
+                   help='Numbers of lists to scan per user')
+
+group = parser.add_argument_group('Logging options')
+group.add_argument('--log-level', default='info',
+                   choices=('debug', 'info', 'warning', 'error', 'fatal'))
+group.add_argument('--log-format', choices=LogFormat.choices(),
+                   default='color')
+
+
+def load_index(registry, version, scorer, args):
+    if args.ann_lists is None:
+        return IVFIndex.load(registry.index_path(version))
+
+    index = IVFIndex.build(scorer.item_embeddings, scorer.item_biases,
+                           n_lists=args.ann_lists)
+    if args.save:
+        # Files of the version may be mapped by the API, so they are not
+        # overwritten
+        new_version = registry.save_index(version, index)
+        if version == registry.latest():
+            registry.publish(new_version)
+    return index
+
+
+def report(scorer, rows, k, probes):
+    start = perf_counter()
+    exact = scorer.top_k(rows, k, exact=True)
+    exact_ms = (perf_counter() - start) * 1000 / len(rows)
+    log.info(f"exact: {exact_ms:.3f} ms/user")
+
+    for n_probe in probes:
+        scorer.index.n_probe = n_probe
+        start = perf_counter()
+        approximate = scorer.top_k(rows, k)
+        elapsed_ms = (perf_counter() - start) * 1000 / len(rows)
+        log.info(f"n_probe={n_probe}: recall@{k}="
+                 f"{recall_at_k(exact, approximate):.4f}, "
+                 f"{elapsed_ms:.3f} ms/user")
+
+
+def main():
+    args = parser.parse_args()
+    clear_environ(lambda i: i.startswith(ENV_VAR_PREFIX))
+    basic_config(args.log_level, args.log_format, buffered=True)
+
+    registry = ModelRegistry(args.model_dir)
+    version = args.version or registry.latest()
+    if version is None:
+        parser.error(f"No model versions in {args.model_dir}")
+    if version not in registry.versions():
+        parser.error(f"No model version {version} in {args.model_dir}")
+    scorer = registry.load_scorer(version)
+    scorer.index = load_index(registry, version, scorer, args)
+    log.info(f"Index has {scorer.index.n_lists} lists "
+             f"for {scorer.num_items} items")
+
+    random = np.random.RandomState(0)
+    rows = random.choice(scorer.num_users,
+                         min(args.users, scorer.num_users), replace=False)
+    report(scorer, rows, args.k, args.probes)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ def validate(type: Callable, constrain: Callable):
 
 
 positive_int = validate(int, constrain=lambda x: x > 0)
+non_negative_int = validate(int, constrain=lambda x: x >= 0)
 
 
 def clear_environ(rule: Callable):
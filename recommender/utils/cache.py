@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+
+from aiohttp.web_app import Application
+from aioredis import Redis, RedisError
+from configargparse import Namespace
+
+from recommender.utils.redis import execute
+
+KEY_PREFIX = "entity"
+
+# Cached items in every format, unlinked when the cache job saves embeddings
+ITEM_KEY_PATTERN = f"{KEY_PREFIX}:item:*"
+
+# Written over invalidated entries, so that a request which loaded the entity
+# before the change cannot cache it again until the tombstone expires. No
+# cached body is a single zero byte.
+TOMBSTONE = b"\x00"
+TOMBSTONE_TTL = 10
+
+log = logging.getLogger(__name__)
+
+
+class EntityCache:
+    """
+    Two-tier cache of serialized entities: a bounded in-process LRU in front
+    of Redis. The in-process tier uses a short TTL, as other processes can
+    only invalidate the Redis one. Entries are only added to Redis if absent,
+    invalidated ones are replaced with a short-lived tombstone.
+    """
+
+    __slots__ = (
+        "redis", "size", "ttl", "local_ttl", "timeout", "entries",
+        "local_hits", "redis_hits", "misses",
+    )
+
+    def __init__(self, redis: Redis, size: int, ttl: int, local_ttl: float,
+                 timeout: Optional[float] = None):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def redis_key(key: str) -> str:
+        return f"{KEY_PREFIX}:{key}"
+
+    def get_local(self, key: str) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set_local(self, key: str, value: bytes):
+        if self.size <= 0:
+            return
+        self.entries[key] = (monotonic() + self.local_ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        try:
+            value = await execute(self.redis.get(self.redis_key(key)),
+                                  self.timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            log.warning("Failed to read %r from cache", key, exc_info=True)
+            value = None
+
+        if value is None or value == TOMBSTONE:
+            self.misses += 1
+            return None
+
+        self.redis_hits += 1
+        self.set_local(key, value)
+        return value
+
+    async def set(self, key: str, value: bytes):
+        try:
+            stored = await execute(
+                self.redis.set(self.redis_key(key), value, expire=self.ttl,
+                               exist=Redis.SET_IF_NOT_EXIST),
+                self.timeout
+            )
+        except (RedisError, OSError, asyncio.TimeoutError):
+            log.warning("Failed to write %r to cache", key, exc_info=True)
+            stored = True
+
+        # Not stored if the key is cached already or has just been
+        # invalidated, the value may be stale then
+        if stored:
+            self.set_local(key, value)
+
+    async def invalidate(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+        pipe = self.redis.pipeline()
+        for key in keys:
+            pipe.set(self.redis_key(key), TOMBSTONE, expire=TOMBSTONE_TTL)
+        try:
+            await execute(pipe.execute(), self.timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            log.warning("Failed to invalidate %r in cache", keys,
+                        exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+
+async def setup_entity_cache(app: Application, args: Namespace) -> EntityCache:
+    app["entity_cache"] = EntityCache(
+        app["redis"],
+        size=args.entity_cache_size,
+        ttl=args.entity_cache_ttl,
+        local_ttl=args.entity_cache_local_ttl,
+        timeout=args.redis_timeout,
+    )
+    log.info("Entity cache holds up to %d entries in process",
+             args.entity_cache_size)
+
+    try:
+        yield
+    finally:
+        app["entity_cache"].entries.clear()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+import numpy as np
+from aiohttp.web_app import Application
+from configargparse import Namespace
+
+from recommender.model.registry import ModelRegistry
+from recommender.model.scoring import Scorer
+
+DEFAULT_MODEL_DIR = "/var/lib/recommender"
+WARM_UP_USERS = 256
+
+log = logging.getLogger(__name__)
+
+
+def warm_up(scorer: Scorer, n_users: int = WARM_UP_USERS):
+    """Score a sample of users, so first requests do not fault pages in"""
+    if not scorer.num_users:
+        return
+    rows = np.linspace(0, scorer.num_users - 1,
+                       min(n_users, scorer.num_users)).astype(np.int64)
+    scorer.top_k(rows, 10)
+
+
+class ModelReloader:
+    """
+    Keeps ``scorer`` at the latest version in the registry. A new version
+    is loaded and warmed up in a thread, then the reference is swapped.
+    Requests take the reference once, so the previous model stays alive
+    until the requests using it finish.
+    """
+
+    __slots__ = ("registry", "n_probe", "interval",
+                 "scorer", "version", "lock", "task")
+
+    def __init__(self, registry: ModelRegistry, n_probe: int,
+                 interval: float):
+        self.registry = registry
+        self.n_probe = n_probe
+        self.interval = interval
+        self.scorer: Optional[Scorer] = None
+        self.version: Optional[str] = None
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    def load(self, version: str) -> Scorer:
+        scorer = self.registry.load_scorer(version, n_probe=self.n_probe)
+        warm_up(scorer)
+        return scorer
+
+    async def reload(self) -> Optional[str]:
+        """Load the latest version if it is new, returns the served one"""
+        async with self.lock:
+            version = self.registry.latest()
+            if version is None or version == self.version:
+                return self.version
+
+            log.info("Loading model version %s from %s",
+                     version, self.registry.root)
+            loop = asyncio.get_event_loop()
+            try:
+                scorer = await loop.run_in_executor(None, self.load, version)
+            except Exception:
+                log.exception("Failed to load model version %s", version)
+                return self.version
+
+            self.scorer = scorer
+            self.version = version
+            log.info("Serving model version %s with %d users and %d items",
+                     version, scorer.num_users, scorer.num_items)
+            if scorer.index is not None:
+                log.info("Model has index with %d lists, probing %d",
+                         scorer.index.n_lists, self.n_probe)
+            return version
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.reload()
+
+    async def start(self):
+        await self.reload()
+        if self.interval > 0:
+            self.task = asyncio.ensure_future(self.run())
+
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGHUP,
+                                lambda: asyncio.ensure_future(self.reload()))
+
+    async def stop(self):
+        asyncio.get_event_loop().remove_signal_handler(signal.SIGHUP)
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def setup_model(app: Application, args: Namespace) -> ModelReloader:
+    reloader = ModelReloader(ModelRegistry(args.model_dir),
+                             n_probe=args.ann_probes,
+                             interval=args.model_check_interval)
+    app["model_reloader"] = reloader
+    await reloader.start()
+    if reloader.version is None:
+        log.warning("No model in %s, recommendations would be served "
+                    "from cache", args.model_dir)
+
+    try:
+        yield
+    finally:
+        await reloader.stop()
+        reloader.scorer = None
@@ -0,0 +1,162 @@
+import io
+import struct
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+COPY_CHUNK_SIZE = 65536
+COPY_READ_SIZE = 1 << 20
+
+FLOAT4_OID = 700
+FLOAT8_OID = 701
+
+ARRAY_HEADER = [
+    ("ndim", ">i4"), ("hasnull", ">i4"), ("oid", ">i4"),
+    ("dim", ">i4"), ("lbound", ">i4"),
+]
+
+
+class Column(ABC):
+    @abstractmethod
+    def cells(self, start: int, stop: int):
+        """Encoded cells of rows [start, stop), as a 2d uint8 array if every
+        cell has the same size, otherwise as a list of bytes"""
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+
+class IntColumn(Column):
+    """int4 column"""
+
+    def __init__(self, values):
+        self.values = np.asarray(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def cells(self, start, stop):
+        values = self.values[start:stop]
+        cells = np.empty(len(values), dtype=[("len", ">i4"), ("value", ">i4")])
+        cells["len"] = 4
+        cells["value"] = values
+        return cells.view(np.uint8).reshape(len(values), -1)
+
+
+class FloatArrayColumn(Column):
+    """real[] or double precision[] column of equally sized arrays"""
+
+    def __init__(self, values, oid: int = FLOAT8_OID):
+        self.values = np.asarray(values)
+        self.oid = oid
+
+    def __len__(self):
+        return len(self.values)
+
+    def cells(self, start, stop):
+        values = self.values[start:stop]
+        size = 4 if self.oid == FLOAT4_OID else 8
+        dim = values.shape[1]
+        element = [("len", ">i4"), ("value", f">f{size}")]
+        cells = np.empty(len(values), dtype=[("len", ">i4")] + ARRAY_HEADER + [
+            ("elements", element, (dim,))
+        ])
+        cells["len"] = 20 + dim * (4 + size)
+        cells["ndim"] = 1
+        cells["hasnull"] = 0
+        cells["oid"] = self.oid
+        cells["dim"] = dim
+        cells["lbound"] = 1
+        cells["elements"]["len"] = size
+        cells["elements"]["value"] = values
+        return cells.view(np.uint8).reshape(len(values), -1)
+
+
+class TextColumn(Column):
+    """text column, None is stored as NULL"""
+
+    def __init__(self, values: Sequence[Optional[str]]):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def cells(self, start, stop):
+        cells = []
+        for value in self.values[start:stop]:
+            if value is None:
+                cells.append(struct.pack("!i", -1))
+            else:
+                value = value.encode()
+                cells.append(struct.pack("!i", len(value)) + value)
+        return cells
+
+
+def encode(columns: Sequence[Column],
+           chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Binary COPY stream of the given columns, chunk by chunk. Every cell is a
+    4-byte length followed by the value, so rows of fixed-width columns are
+    built with NumPy, only text columns need a per-row loop.
+    """
+    yield COPY_HEADER
+
+    n_rows = len(columns[0]) if columns else 0
+    field_count = struct.pack("!h", len(columns))
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        cells = [column.cells(start, stop) for column in columns]
+
+        if all(isinstance(c, np.ndarray) for c in cells):
+            counts = np.frombuffer(field_count, dtype=np.uint8)
+            counts = np.broadcast_to(counts, (stop - start, 2))
+            yield np.hstack([counts] + cells).tobytes()
+        else:
+            cells = [
+                c if isinstance(c, list) else [row.tobytes() for row in c]
+                for c in cells
+            ]
+            yield b"".join(
+                field_count + b"".join(row) for row in zip(*cells)
+            )
+
+    yield COPY_TRAILER
+
+
+class IteratorReader(io.RawIOBase):
+    """File-like object reading from an iterator of bytes chunks"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk:
+            try:
+                self.chunk = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+
+def copy_from(conn, table: str, column_names: Sequence[str],
+              columns: Sequence[Column],
+              chunk_size: int = COPY_CHUNK_SIZE):
+    """Load columns into a table through a raw psycopg2 connection"""
+    query = "COPY {} ({}) FROM STDIN WITH (FORMAT binary)".format(
+        table, ", ".join(column_names)
+    )
+    reader = io.BufferedReader(IteratorReader(encode(columns, chunk_size)))
+    with conn.cursor() as cursor:
+        cursor.copy_expert(query, reader, size=COPY_READ_SIZE)
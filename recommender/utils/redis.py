@@ -1,21 +1,143 @@
+import asyncio
 import logging
+from typing import Any, Awaitable, List, Optional
+
+import numpy as np
 
 from aiohttp.web_app import Application
-from aioredis import create_redis, Redis
+from aioredis import create_redis_pool, Redis, RedisError
 from configargparse import Namespace
 
 CENSORED = "***"
 DEFAULT_REDIS_URL = "redis://:hackme@localhost:6379/0"
+DEFAULT_REDIS_TIMEOUT = 1.0
+
+# Set of existing user ids, maintained by the API and the cache job. The API
+# only trusts it once the cache job has filled it and set USERS_READY_KEY.
+USERS_KEY = "users"
+USERS_READY_KEY = "users:ready"
+# Set built by the cache job and swapped in over USERS_KEY. The API mirrors
+# its changes to it, so users created while the job runs are not lost.
+USERS_BUILD_KEY = "users:build"
+
+# Every refresh of precomputed recommendations is written under a new
+# generation prefix, readers use the one GENERATION_KEY points to
+GENERATION_KEY = "generation"
+GENERATION_COUNTER_KEY = "generation:counter"
+GENERATION_PATTERN = "gen:*"
+DEFAULT_GENERATION_INTERVAL = 1.0
+
+# Recommendations are stored as packed little-endian arrays, so the first
+# N items are read with GETRANGE and decoded without parsing every element
+ITEM_DTYPE = np.dtype("<u4")
+SCORE_DTYPE = np.dtype("<f2")
 
 log = logging.getLogger(__name__)
 
 
+def generation_key(generation: int, key: str) -> str:
+    return f"gen:{generation}:{key}"
+
+
+def parse_generation(key: bytes) -> int:
+    return int(key.split(b":", 2)[1])
+
+
+def recommendations_key(generation: int, user_id: int) -> str:
+    return generation_key(generation, f"recommendations:{user_id}")
+
+
+def scores_key(generation: int, user_id: int) -> str:
+    return generation_key(generation, f"recommendations:{user_id}:scores")
+
+
+def latest_key(generation: int) -> str:
+    return generation_key(generation, "latest")
+
+
+def unpack(value: bytes, dtype: np.dtype = ITEM_DTYPE) -> np.ndarray:
+    """Read-only array viewing the buffer of a packed value, without a copy"""
+    return np.frombuffer(memoryview(value), dtype=dtype)
+
+
+async def execute(command: Awaitable, timeout: Optional[float]) -> Any:
+    """Await a Redis command, raising asyncio.TimeoutError after timeout"""
+    return await asyncio.wait_for(command, timeout)
+
+
+class Pipeline:
+    """
+    Commands queued on the pipeline are sent to Redis in a single round-trip
+    by execute(), which returns their results in the same order.
+    """
+
+    __slots__ = ("pipe", "timeout")
+
+    def __init__(self, redis: Redis, timeout: Optional[float]):
+        self.pipe = redis.pipeline()
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    async def execute(self) -> List[Any]:
+        return await execute(self.pipe.execute(), self.timeout)
+
+
+class GenerationWatcher:
+    """
+    Keeps the current generation of precomputed recommendations, polling
+    the pointer key, so requests do not need an extra round-trip to read it.
+    """
+
+    __slots__ = ("redis", "interval", "timeout", "generation", "task")
+
+    def __init__(self, redis: Redis, interval: float,
+                 timeout: Optional[float]):
+        self.redis = redis
+        self.interval = interval
+        self.timeout = timeout
+        self.generation: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        try:
+            value = await execute(self.redis.get(GENERATION_KEY), self.timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            log.warning("Failed to read cache generation", exc_info=True)
+            return
+
+        generation = int(value) if value is not None else None
+        if generation != self.generation:
+            log.info("Switching to cache generation %s", generation)
+            self.generation = generation
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    async def start(self):
+        await self.refresh()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
 async def setup_redis(app: Application, args: Namespace) -> Redis:
     db_info = args.redis_url.with_password(CENSORED)
     log.info("Connecting to cache: %s", db_info)
 
-    app["redis"] = await create_redis(str(args.redis_url))
-    await app["redis"].ping()
+    app["redis"] = await create_redis_pool(
+        str(args.redis_url),
+        minsize=args.redis_pool_min_size,
+        maxsize=args.redis_pool_max_size,
+        timeout=args.redis_timeout,
+    )
+    app["redis_timeout"] = args.redis_timeout
+    await execute(app["redis"].ping(), args.redis_timeout)
     log.info(f"Connected to cache %s", db_info)
 
     try:
@@ -25,3 +147,16 @@ async def setup_redis(app: Application, args: Namespace) -> Redis:
         app["redis"].close()
         await app["redis"].wait_closed()
         log.info("Disconnected from cache %s", db_info)
+
+
+async def setup_generation_watcher(app: Application,
+                                   args: Namespace) -> GenerationWatcher:
+    watcher = GenerationWatcher(app["redis"], args.redis_generation_interval,
+                                args.redis_timeout)
+    await watcher.start()
+    app["generation_watcher"] = watcher
+
+    try:
+        yield
+    finally:
+        await watcher.stop()
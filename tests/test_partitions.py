@@ -0,0 +1,72 @@
+from datetime import date
+
+from recommender.db.partitions import (
+    add_months, create_partitions, drop_partitions, partition_month,
+)
+
+
+class FakeConnection:
+    """Lists the given partitions and records the other statements"""
+
+    def __init__(self, partitions=()):
+        self.partitions = sorted(partitions)
+        self.statements = []
+
+    def execute(self, query, **params):
+        if not isinstance(query, str):
+            return [(name,) for name in self.partitions]
+        self.statements.append(query)
+
+
+def test_add_months_rolls_over_year():
+    assert add_months(date(2026, 12, 1), 1) == date(2027, 1, 1)
+    assert add_months(date(2027, 1, 1), -1) == date(2026, 12, 1)
+    assert add_months(date(2026, 11, 1), 14) == date(2028, 1, 1)
+
+
+def test_partition_month():
+    assert partition_month("interactions_p202701") == date(2027, 1, 1)
+    assert partition_month("interactions_legacy") == date(1970, 1, 1)
+    assert partition_month("interactions_other") is None
+
+
+def test_create_partitions_month_rollover():
+    conn = FakeConnection(["interactions_p202612"])
+    create_partitions(conn, date(2026, 12, 31), months_ahead=1)
+    assert conn.statements == [
+        "CREATE TABLE interactions_p202701 PARTITION OF interactions "
+        "FOR VALUES FROM ('2027-01-01') TO ('2027-02-01')"
+    ]
+
+
+def test_create_partitions_after_missed_runs():
+    # Partitions of the current month onwards are created, even if earlier
+    # runs did not create them ahead
+    conn = FakeConnection(["interactions_p202610"])
+    create_partitions(conn, date(2026, 12, 5), months_ahead=1)
+    assert conn.statements == [
+        "CREATE TABLE interactions_p202612 PARTITION OF interactions "
+        "FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')",
+        "CREATE TABLE interactions_p202701 PARTITION OF interactions "
+        "FOR VALUES FROM ('2027-01-01') TO ('2027-02-01')",
+    ]
+
+
+def test_drop_partitions():
+    conn = FakeConnection([
+        "interactions_p202512", "interactions_p202601", "interactions_p202612",
+    ])
+    drop_partitions(conn, date(2027, 1, 15), retention_months=12)
+    assert conn.statements == [
+        "ALTER TABLE interactions DETACH PARTITION interactions_p202512",
+        "DROP TABLE interactions_p202512",
+    ]
+
+
+def test_drop_partitions_drops_legacy():
+    conn = FakeConnection(["interactions_legacy", "interactions_p202612"])
+    drop_partitions(conn, date(2027, 1, 15), retention_months=12)
+    assert conn.statements == [
+        "ALTER TABLE interactions DETACH PARTITION interactions_legacy",
+        "DROP TABLE interactions_legacy",
+    ]
@@ -0,0 +1,58 @@
+import struct
+
+import numpy as np
+import pytest
+
+from recommender.utils.pg import decode_real_array
+from recommender.utils.pgcopy import FLOAT4_OID, FloatArrayColumn
+
+
+def array_send(values):
+    """array_send() output of a one-dimensional real[]"""
+    has_nulls = any(value is None for value in values)
+    data = struct.pack("!iiiii", 1, has_nulls, FLOAT4_OID, len(values), 1)
+    for value in values:
+        if value is None:
+            data += struct.pack("!i", -1)
+        else:
+            data += struct.pack("!if", 4, value)
+    return data
+
+
+def test_decode_none():
+    assert decode_real_array(None) is None
+
+
+def test_decode_empty():
+    data = struct.pack("!iii", 0, 0, FLOAT4_OID)
+    array = decode_real_array(data)
+    assert array.dtype == np.float32
+    assert array.shape == (0,)
+
+
+@pytest.mark.parametrize("values", [[1.5], [0.0, -2.25, 3e-8, 1e30]])
+def test_decode(values):
+    array = decode_real_array(array_send(values))
+    assert array.dtype == np.float32
+    np.testing.assert_array_equal(array, np.array(values, dtype=np.float32))
+
+
+def test_decode_nulls():
+    array = decode_real_array(array_send([1.0, None, 2.0]))
+    np.testing.assert_array_equal(array, [1.0, np.nan, 2.0])
+
+
+def test_decode_multidimensional():
+    data = struct.pack("!iiiiiii", 2, 0, FLOAT4_OID, 1, 1, 1, 1)
+    data += struct.pack("!if", 4, 1.0)
+    with pytest.raises(ValueError):
+        decode_real_array(data)
+
+
+def test_copy_round_trip():
+    # COPY cells of real[] are length prefixed array_send() values
+    values = np.random.RandomState(0).randn(4, 8).astype(np.float32)
+    cells = FloatArrayColumn(values, FLOAT4_OID).cells(0, len(values))
+    for row, cell in zip(values, cells):
+        np.testing.assert_array_equal(decode_real_array(cell[4:].tobytes()),
+                                      row)
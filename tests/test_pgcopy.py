@@ -0,0 +1,102 @@
+import struct
+
+import numpy as np
+import pytest
+
+from recommender.utils.pgcopy import (
+    COPY_HEADER, COPY_TRAILER, FLOAT4_OID, FLOAT8_OID, Column,
+    FloatArrayColumn, IntColumn, IteratorReader, TextColumn, encode,
+)
+
+
+def decode_int(data):
+    return struct.unpack("!i", data)[0]
+
+
+def decode_float_array(data):
+    ndim, hasnull, oid, dim, lbound = struct.unpack_from("!iiiii", data)
+    assert (ndim, hasnull, lbound) == (1, 0, 1)
+    fmt = "f" if oid == FLOAT4_OID else "d"
+    size = struct.calcsize(fmt)
+    values = []
+    offset = 20
+    for _ in range(dim):
+        assert struct.unpack_from("!i", data, offset)[0] == size
+        values.append(struct.unpack_from(f"!{fmt}", data, offset + 4)[0])
+        offset += 4 + size
+    assert offset == len(data)
+    return values
+
+
+def decode(stream, decoders):
+    """Rows of a binary COPY stream, fields decoded by column"""
+    assert stream.startswith(COPY_HEADER)
+    assert stream.endswith(COPY_TRAILER)
+    body = stream[len(COPY_HEADER):-len(COPY_TRAILER)]
+
+    rows = []
+    offset = 0
+    while offset < len(body):
+        n_fields, = struct.unpack_from("!h", body, offset)
+        assert n_fields == len(decoders)
+        offset += 2
+        row = []
+        for decoder in decoders:
+            length, = struct.unpack_from("!i", body, offset)
+            offset += 4
+            if length < 0:
+                row.append(None)
+                continue
+            row.append(decoder(body[offset:offset + length]))
+            offset += length
+        rows.append(tuple(row))
+    return rows
+
+
+def test_column_is_abstract():
+    with pytest.raises(TypeError):
+        Column()
+
+
+def test_empty():
+    assert b"".join(encode([IntColumn([])])) == COPY_HEADER + COPY_TRAILER
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_int_columns(chunk_size):
+    users, items = [1, 2, 2147483647], [-1, 0, 5]
+    stream = b"".join(encode([IntColumn(users), IntColumn(items)],
+                             chunk_size=chunk_size))
+    assert decode(stream, [decode_int, decode_int]) == list(zip(users, items))
+
+
+@pytest.mark.parametrize("oid,dtype", [
+    (FLOAT4_OID, np.float32),
+    (FLOAT8_OID, np.float64),
+])
+def test_float_array_column(oid, dtype):
+    values = np.random.RandomState(0).randn(5, 3).astype(dtype)
+    stream = b"".join(encode([IntColumn(range(5)),
+                              FloatArrayColumn(values, oid)], chunk_size=2))
+    rows = decode(stream, [decode_int, decode_float_array])
+    assert [row[0] for row in rows] == list(range(5))
+    np.testing.assert_array_equal(
+        np.array([row[1] for row in rows], dtype=dtype), values
+    )
+
+
+def test_text_column():
+    labels = ["tag", None, "", "тег"]
+    stream = b"".join(encode([IntColumn(range(4)), TextColumn(labels)],
+                             chunk_size=3))
+    rows = decode(stream, [decode_int, bytes.decode])
+    assert rows == list(zip(range(4), labels))
+
+
+def test_iterator_reader():
+    reader = IteratorReader(iter([b"ab", b"", b"cde"]))
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 2
+    assert reader.readinto(buffer) == 3
+    assert bytes(buffer[:3]) == b"cde"
+    assert reader.readinto(buffer) == 0